@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import pandas as pd
+
+# Content-addressed cache of intermediate artifacts (mappings, edge arrays,
+# CSR matrices) under processed_dir/CACHE_DIRNAME.
+# Every entry is a directory named after a key that hashes the fingerprint of
+# the input data together with the parameters that produced it, so a change in
+# either gives a new entry instead of silently reusing a stale one.
+CACHE_DIRNAME = "cache"
+
+# Name of the file that marks a complete entry, its mtime is the last use
+_ENTRY_MARKER = "entry.json"
+
+# Fingerprint of a file from its size and modification time.
+# With full_hash=True the content is hashed (slow on the raw dataset).
+def file_fingerprint(path, full_hash=False):
+  stat = os.stat(path)
+  if not full_hash:
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+# Fingerprint of the content of a DataFrame (values and column names)
+def dataframe_fingerprint(df):
+  digest = hashlib.sha256()
+  digest.update("\n".join(map(str, df.columns)).encode())
+  digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+  return digest.hexdigest()
+
+# Key of an artifact: hash of the input fingerprint and of the parameters
+def cache_key(fingerprint, **params):
+  payload = json.dumps({"input": fingerprint, **params}, sort_keys=True, default=str)
+  return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+def _cache_root(processed_dir):
+  return os.path.join(processed_dir, CACHE_DIRNAME)
+
+# Prefix of the entries being deleted by evict_lru
+_EVICT_PREFIX = ".evict-"
+
+# Return the directory of a complete entry (and mark it as used), or None
+def cache_get(processed_dir, key):
+  entry_dir = os.path.join(_cache_root(processed_dir), key)
+  marker = os.path.join(entry_dir, _ENTRY_MARKER)
+  try:
+    # The mtime of the marker is the last use, read by evict_lru
+    os.utime(marker)
+  except FileNotFoundError:
+    # Not cached, or evicted by a concurrent run
+    return None
+  return entry_dir
+
+# Read an entry with read_fn(entry_dir) and return the result, or None on a
+# miss. A concurrent evict_lru can remove the entry after cache_get returned
+# it: the reader then gets FileNotFoundError, which is handled as a miss.
+def cache_read(processed_dir, key, read_fn):
+  entry_dir = cache_get(processed_dir, key)
+  if entry_dir is None:
+    return None
+  try:
+    return read_fn(entry_dir)
+  except FileNotFoundError:
+    print(f"[artifact_cache] Entry {key} was evicted while reading it, cache miss")
+    return None
+
+# Create an entry: write_fn(tmp_dir) writes the artifacts in a private
+# temporary directory, which is then renamed to its final name in one step.
+# Readers never see a half-written entry, and if a concurrent run publishes
+# the same key first its entry is kept and ours is dropped.
+def cache_put(processed_dir, key, write_fn, params=None):
+  root = _cache_root(processed_dir)
+  os.makedirs(root, exist_ok=True)
+  tmp_dir = tempfile.mkdtemp(prefix=f".tmp-{key}-", dir=root)
+  try:
+    write_fn(tmp_dir)
+    with open(os.path.join(tmp_dir, _ENTRY_MARKER), "w") as f:
+      json.dump({"key": key, "params": params or {}, "created": time.time()},
+                f, default=str)
+    entry_dir = os.path.join(root, key)
+    try:
+      os.rename(tmp_dir, entry_dir)
+    except OSError:
+      # Another run published this key in the meantime
+      if not os.path.exists(os.path.join(entry_dir, _ENTRY_MARKER)):
+        raise
+      shutil.rmtree(tmp_dir, ignore_errors=True)
+  except BaseException:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    raise
+  return entry_dir
+
+def _dir_size(path):
+  total = 0
+  for dirpath, _, filenames in os.walk(path):
+    for filename in filenames:
+      total += os.path.getsize(os.path.join(dirpath, filename))
+  return total
+
+# Remove the least recently used entries until the cache holds at most
+# max_bytes. Temporary directories of runs still writing are not touched.
+# An entry is first renamed to a tombstone (one atomic step, so cache_get of
+# another run sees either the whole entry or nothing) and then deleted;
+# readers that already got it fall back to a miss (see cache_read).
+# Returns the keys that were evicted.
+def evict_lru(processed_dir, max_bytes):
+  root = _cache_root(processed_dir)
+  if not os.path.isdir(root):
+    return []
+
+  entries = []
+  for key in os.listdir(root):
+    if key.startswith(_EVICT_PREFIX):
+      # Tombstone left by an interrupted eviction
+      shutil.rmtree(os.path.join(root, key), ignore_errors=True)
+      continue
+    marker = os.path.join(root, key, _ENTRY_MARKER)
+    if key.startswith(".tmp-"):
+      continue
+    try:
+      last_use = os.path.getmtime(marker)
+    except FileNotFoundError:
+      continue
+    entries.append((last_use, key, _dir_size(os.path.join(root, key))))
+
+  total = sum(size for _, _, size in entries)
+  evicted = []
+  for _, key, size in sorted(entries):
+    if total <= max_bytes:
+      break
+    tombstone = os.path.join(root, f"{_EVICT_PREFIX}{key}-{uuid.uuid4().hex}")
+    try:
+      os.rename(os.path.join(root, key), tombstone)
+    except FileNotFoundError:
+      # Already evicted by a concurrent run
+      continue
+    shutil.rmtree(tombstone, ignore_errors=True)
+    total -= size
+    evicted.append(key)
+
+  if evicted:
+    print(f"[artifact_cache] Evicted {len(evicted)} entries, cache size {total / 2**20:.1f} MB")
+  return evicted
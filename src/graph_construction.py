@@ -1,8 +1,220 @@
 import os
+import heapq
 import itertools
+import tempfile
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from src.utils_io import ensure_dirs
+from src.storage import compact_edges, save_table, storage_format_of
+
+# Methods available in build_book_cooccurrence_edges
+# "counter": per-user loop with itertools.combinations and a Counter
+# "numpy":   vectorised pair generation on sorted int arrays
+# "sparse":  upper triangle of B^T B, with B the user x book incidence matrix
+# "sketch":  count-min sketch pass, then exact counts of the pairs that can
+#            reach min_weight only (same output, bounded by memory_budget)
+COOCCURRENCE_METHODS = ("counter", "numpy", "sparse", "sketch")
+
+# What build_book_cooccurrence_edges does with users above max_books_per_user
+# "drop":      skip them (original behaviour)
+# "tile":      keep them, their pairs are generated tile by tile
+#              (book chunk x book chunk) with bounded memory per task
+# "normalize": as "tile", but each of their pairs weighs 1 / (n - 1) for a
+#              user with n books, so a heavy user adds at most 1 to the
+#              strength of each of its books
+HEAVY_USER_MODES = ("drop", "tile", "normalize")
+
+# Sum the counts of equal keys: returns sorted unique keys and their totals
+def reduce_pair_counts(keys, counts):
+  order = np.argsort(keys, kind="stable")
+  keys = keys[order]
+  counts = counts[order]
+  if keys.size == 0:
+    return keys, counts
+  starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+  return keys[starts], np.add.reduceat(counts, starts)
+
+# Deduplicate (user, book) rows and sort them by user, then book, keeping only
+# users with at least 2 books (and at most max_books_per_user).
+# Returns the books of the kept users (each user's books are a contiguous
+# increasing run), the length of every run and num_books.
+def _user_book_runs(user_idx, book_idx, max_books_per_user=None):
+  num_books = int(book_idx.max()) + 1
+  rows = np.unique(user_idx * num_books + book_idx)
+  users = rows // num_books
+  books = rows % num_books
+
+  # Length of each user's run
+  run_starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+  run_lengths = np.diff(np.r_[run_starts, rows.size])
+
+  # Users with fewer than 2 books create no edge, heavy users are skipped
+  keep_run = run_lengths >= 2
+  if max_books_per_user is not None:
+    keep_run &= run_lengths <= max_books_per_user
+  keep_row = np.repeat(keep_run, run_lengths)
+  return books[keep_row], run_lengths[keep_run], num_books
+
+# Generate the pair keys i * num_books + j (i < j) of all the runs, about
+# batch_size keys at a time. For every shift k, the pair (run[p], run[p + k])
+# is valid when p + k is still inside the run: looping over k emits all i < j
+# pairs of all users, k at a time for every user.
+# The rows with a partner at shift k are a subset of those at shift k - 1,
+# so the candidate rows shrink at every shift and the total work is
+# O(pairs), not O(rows * longest run).
+def _pair_key_batches(books, run_lengths, num_books, batch_size=5_000_000):
+  if books.size == 0:
+    return
+  run_starts = np.r_[0, np.cumsum(run_lengths)[:-1]]
+  pos_in_run = np.arange(books.size) - np.repeat(run_starts, run_lengths)
+  remaining = np.repeat(run_lengths, run_lengths) - pos_in_run - 1
+
+  buffer_keys = []
+  buffered = 0
+  left = np.flatnonzero(remaining >= 1)
+  for k in range(1, int(run_lengths.max())):
+    # Rows that still have a partner k positions ahead in their run
+    if k > 1:
+      left = left[remaining[left] >= k]
+    buffer_keys.append(books[left] * num_books + books[left + k])
+    buffered += left.size
+
+    if buffered >= batch_size:
+      yield np.concatenate(buffer_keys)
+      buffer_keys = []
+      buffered = 0
+
+  if buffer_keys:
+    yield np.concatenate(buffer_keys)
+
+# Count book co-occurrences with NumPy only, no Python loop over users.
+# (user, book) rows are deduplicated and sorted by user then book (see
+# _user_book_runs), pairs are generated by _pair_key_batches, each pair is
+# encoded as i * num_books + j in an int64 array and partial counts are
+# reduced with sort/unique every time batch_size pairs are buffered.
+def count_cooccurrence_pairs(
+  user_idx,
+  book_idx,
+  max_books_per_user=None,
+  batch_size=5_000_000,
+):
+  user_idx = np.asarray(user_idx, dtype=np.int64)
+  book_idx = np.asarray(book_idx, dtype=np.int64)
+  empty = np.empty(0, dtype=np.int64)
+  if book_idx.size == 0:
+    return empty, empty, empty
+
+  books, run_lengths, num_books = _user_book_runs(
+    user_idx, book_idx, max_books_per_user)
+
+  keys_acc = empty
+  counts_acc = empty
+  for batch_keys in _pair_key_batches(books, run_lengths, num_books, batch_size):
+    keys_acc, counts_acc = reduce_pair_counts(
+      np.concatenate([keys_acc, batch_keys]),
+      np.concatenate([counts_acc, np.ones(batch_keys.size, dtype=np.int64)]),
+    )
+
+  # Decode the pair keys back to (i, j) with i < j
+  return keys_acc // num_books, keys_acc % num_books, counts_acc
+
+# Count-min sketch of pair counts: depth rows of width counters (uint32),
+# width a power of two so the hash of a row is a multiply-shift on uint64 keys.
+# The estimate of a key is the minimum of its depth counters, it is never
+# below the true count.
+def _sketch_slots(keys, multiplier, width_bits):
+  return ((keys * multiplier) >> np.uint64(64 - width_bits)).astype(np.intp)
+
+# Approximate-then-exact co-occurrence count for a min_weight threshold:
+# - pass 1 streams the pairs into a count-min sketch sized from memory_budget
+# - pass 2 streams the pairs again and counts exactly only the candidates
+#   whose sketch estimate reaches min_weight
+# A count-min sketch never underestimates, so every pair with count >=
+# min_weight is a candidate and the output is identical to the exact count
+# filtered by min_weight. The sketch takes about half of memory_budget and the
+# pair batches are sized from the other half; the exact counts of the
+# candidates come on top (more if the sketch is too small for the data and
+# lets many light pairs through).
+def count_cooccurrence_pairs_sketch(
+  user_idx,
+  book_idx,
+  min_weight,
+  max_books_per_user=None,
+  memory_budget=256 * 2**20,
+  depth=4,
+  batch_size=None,
+  seed=0,
+):
+  if min_weight is None or min_weight <= 1:
+    raise ValueError("The sketch build needs min_weight > 1.")
+  user_idx = np.asarray(user_idx, dtype=np.int64)
+  book_idx = np.asarray(book_idx, dtype=np.int64)
+  empty = np.empty(0, dtype=np.int64)
+  if book_idx.size == 0:
+    return empty, empty, empty
+
+  books, run_lengths, num_books = _user_book_runs(
+    user_idx, book_idx, max_books_per_user)
+
+  # Largest power of two width that keeps the sketch in half the budget
+  counter_bytes = np.dtype(np.uint32).itemsize
+  width_bits = max(10, int(np.log2(memory_budget / 2 / (depth * counter_bytes))))
+  width = 1 << width_bits
+  if batch_size is None:
+    # About 8 arrays of 8 bytes per key are alive while a batch is processed
+    # (keys, uint64 keys, slots, estimate, sort temporaries)
+    batch_size = max(100_000, memory_budget // 2 // 64)
+  sketch = np.zeros((depth, width), dtype=np.uint32)
+  rng = np.random.default_rng(seed)
+  # Odd 64-bit multipliers, one per row
+  multipliers = [
+    np.uint64(m | 1) for m in rng.integers(0, 2**63, size=depth, dtype=np.uint64)
+  ]
+
+  # Pass 1: every pair increments one counter per row
+  total_pairs = 0
+  for batch_keys in _pair_key_batches(books, run_lengths, num_books, batch_size):
+    total_pairs += batch_keys.size
+    hash_keys = batch_keys.astype(np.uint64)
+    del batch_keys
+    for row, multiplier in enumerate(multipliers):
+      # Counts per touched slot only, no temporary of the sketch width
+      slots, slot_counts = np.unique(
+        _sketch_slots(hash_keys, multiplier, width_bits), return_counts=True)
+      sketch[row][slots] += slot_counts.astype(np.uint32)
+
+  # Pass 2: exact counts of the candidate pairs only
+  keys_acc = empty
+  counts_acc = empty
+  for batch_keys in _pair_key_batches(books, run_lengths, num_books, batch_size):
+    hash_keys = batch_keys.astype(np.uint64)
+    estimate = sketch[0][_sketch_slots(hash_keys, multipliers[0], width_bits)]
+    for row in range(1, depth):
+      np.minimum(
+        estimate,
+        sketch[row][_sketch_slots(hash_keys, multipliers[row], width_bits)],
+        out=estimate,
+      )
+    del hash_keys
+    batch_keys = batch_keys[estimate >= min_weight]
+    keys_acc, counts_acc = reduce_pair_counts(
+      np.concatenate([keys_acc, batch_keys]),
+      np.concatenate([counts_acc, np.ones(batch_keys.size, dtype=np.int64)]),
+    )
+
+  candidates = keys_acc.size
+  keep = counts_acc >= min_weight
+  keys_acc, counts_acc = keys_acc[keep], counts_acc[keep]
+  print(
+    f"[count_cooccurrence_pairs_sketch] sketch {depth} x {width} "
+    f"({sketch.nbytes / 2**20:.1f} MB), {total_pairs} pairs, "
+    f"{candidates} candidates, {keys_acc.size} edges with weight >= {min_weight}"
+  )
+
+  return keys_acc // num_books, keys_acc % num_books, counts_acc
 
 # Build an undirected co-occurrence graph of books
 def build_book_cooccurrence_edges(
@@ -11,10 +223,406 @@ def build_book_cooccurrence_edges(
   save_name="edges_books_core_small.csv",
   max_books_per_user=None,
   min_weight=1,
+  method="counter",
+  workers=None,
+  storage_format="csv",
+  compact=False,
+  heavy_users="drop",
+  tile_size=1024,
+  memory_budget=256 * 2**20,
 ):
+  if method not in COOCCURRENCE_METHODS:
+    raise ValueError(
+      f"method must be one of {COOCCURRENCE_METHODS}, got {method!r}.")
+  if heavy_users not in HEAVY_USER_MODES:
+    raise ValueError(
+      f"heavy_users must be one of {HEAVY_USER_MODES}, got {heavy_users!r}.")
+  # Heavy users are counted separately from the users under the cap
+  keep_heavy = heavy_users != "drop" and max_books_per_user is not None
+  if keep_heavy and method == "sketch":
+    raise ValueError("The sketch build prunes by min_weight before heavy users "
+                     "could be added, use heavy_users='drop'.")
+  # (with heavy users kept, the workers also share their tiles)
+  if workers is not None and workers > 1 and method != "numpy" and not keep_heavy:
+    raise ValueError("workers > 1 is only supported with method='numpy' "
+                     "or with heavy users kept.")
+
   ensure_dirs([processed_dir])
   print("\n[build_book_cooccurrence_edges] Building book co-occurrence graph...")
 
+  if method in ("numpy", "sparse", "sketch"):
+    if method == "numpy" and workers is not None and workers > 1:
+      # Users are sharded across a process pool
+      src_nodes, dst_nodes, weights = count_cooccurrence_pairs_parallel(
+        df_indexed["user_idx"].values,
+        df_indexed["book_idx"].values,
+        max_books_per_user=max_books_per_user,
+        workers=workers,
+        tmp_dir=processed_dir,
+      )
+    elif method == "numpy":
+      src_nodes, dst_nodes, weights = count_cooccurrence_pairs(
+        df_indexed["user_idx"].values,
+        df_indexed["book_idx"].values,
+        max_books_per_user=max_books_per_user,
+      )
+    elif method == "sketch":
+      # Only pairs with weight >= min_weight come out
+      src_nodes, dst_nodes, weights = count_cooccurrence_pairs_sketch(
+        df_indexed["user_idx"].values,
+        df_indexed["book_idx"].values,
+        min_weight=min_weight,
+        max_books_per_user=max_books_per_user,
+        memory_budget=memory_budget,
+      )
+    else:
+      # min_weight is already applied block by block here
+      src_nodes, dst_nodes, weights = count_cooccurrence_pairs_sparse(
+        df_indexed["user_idx"].values,
+        df_indexed["book_idx"].values,
+        max_books_per_user=max_books_per_user,
+        # Pairs of heavy users are added later, so nothing can be pruned yet
+        min_weight=1 if keep_heavy else min_weight,
+      )
+    print(f"[build_book_cooccurrence_edges] Number of distinct edges: {len(weights)}")
+    # Edges come out sorted by (src_book_idx, dst_book_idx)
+    edges_df = pd.DataFrame({
+      "src_book_idx": src_nodes,
+      "dst_book_idx": dst_nodes,
+      "weight": weights,
+    })
+  else:
+    edges_df = _build_edges_counter(df_indexed, max_books_per_user)
+
+  if keep_heavy:
+    heavy_src, heavy_dst, heavy_weights, heavy_metrics = count_heavy_user_pairs(
+      df_indexed["user_idx"].values,
+      df_indexed["book_idx"].values,
+      max_books_per_user=max_books_per_user,
+      tile_size=tile_size,
+      normalize=(heavy_users == "normalize"),
+      workers=workers,
+    )
+    edges_df, heavy_metrics["heavy_only_edges"] = _merge_edge_counts(
+      edges_df, heavy_src, heavy_dst, heavy_weights)
+    print(
+      f"[build_book_cooccurrence_edges] Heavy users kept ({heavy_users}): "
+      f"{heavy_metrics['heavy_users']} users, "
+      f"{heavy_metrics['heavy_user_pairs']} of "
+      f"{heavy_metrics['heavy_user_pairs'] + heavy_metrics['light_user_pairs']} "
+      f"pairs, {heavy_metrics['heavy_only_edges']} edges only from heavy users"
+    )
+    # Kept with the edge list, the return value does not change
+    edges_df.attrs["heavy_user_metrics"] = heavy_metrics
+
+  # Compact mode: int32 indices and uint16/uint32 weights
+  if compact:
+    edges_df = compact_edges(edges_df)
+
+  # Filter edges by minimum weight
+  if min_weight is not None and min_weight > 1 and not edges_df.empty:
+    before = len(edges_df)
+    edges_df = edges_df[edges_df["weight"] >= min_weight].copy()
+    after = len(edges_df)
+    print(
+      f"[build_book_cooccurrence_edges] Filtered edges with weight < {min_weight}: "
+      f"{before} -> {after}"
+    )
+  
+  print("\n[build_book_cooccurrence_edges] Edge list (first rows):")
+  print(edges_df.head())
+
+  # Save the edge list (CSV, Parquet or one .npy per column)
+  edges_path = save_table(edges_df, processed_dir, save_name, storage_format)
+  print(f"[build_book_cooccurrence_edges] Edge list saved in: {edges_path}")
+
+  return edges_df
+
+# Worker of count_cooccurrence_pairs_parallel: count the pairs of the rows
+# lo..hi-1 of the memory-mapped (user, book) arrays and write the sorted pair
+# keys and counts next to them. Only the shard id goes back to the parent.
+def _count_pairs_shard(shard_dir, shard_id, lo, hi, num_books, max_books_per_user):
+  users = np.load(os.path.join(shard_dir, "users.npy"), mmap_mode="r")
+  books = np.load(os.path.join(shard_dir, "books.npy"), mmap_mode="r")
+  src_nodes, dst_nodes, counts = count_cooccurrence_pairs(
+    users[lo:hi],
+    books[lo:hi],
+    max_books_per_user=max_books_per_user,
+  )
+  keys = src_nodes * num_books + dst_nodes
+  np.save(os.path.join(shard_dir, f"keys_{shard_id}.npy"), keys)
+  np.save(os.path.join(shard_dir, f"counts_{shard_id}.npy"), counts)
+  return shard_id
+
+# Count book co-occurrences with a pool of worker processes.
+# Users are split into contiguous ranges with about the same number of pairs,
+# every worker runs count_cooccurrence_pairs on its range, and the partial
+# counts travel through .npy files memory-mapped by the parent instead of
+# being pickled back. The result is identical to count_cooccurrence_pairs.
+def count_cooccurrence_pairs_parallel(
+  user_idx,
+  book_idx,
+  max_books_per_user=None,
+  workers=None,
+  tmp_dir=None,
+):
+  workers = workers or os.cpu_count() or 1
+  user_idx = np.asarray(user_idx, dtype=np.int64)
+  book_idx = np.asarray(book_idx, dtype=np.int64)
+  empty = np.empty(0, dtype=np.int64)
+  if book_idx.size == 0:
+    return empty, empty, empty
+
+  # Sort rows by user so each user's books are contiguous
+  num_books = int(book_idx.max()) + 1
+  order = np.argsort(user_idx, kind="stable")
+  users = user_idx[order]
+  books = book_idx[order]
+
+  # Split on user boundaries, balancing the number of pairs per shard
+  run_starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+  run_lengths = np.diff(np.r_[run_starts, users.size])
+  pairs_per_user = run_lengths * (run_lengths - 1) // 2
+  if max_books_per_user is not None:
+    pairs_per_user[run_lengths > max_books_per_user] = 0
+  cum_pairs = np.cumsum(pairs_per_user)
+  targets = cum_pairs[-1] * np.arange(1, workers) / workers
+  cut_runs = np.searchsorted(cum_pairs, targets, side="right")
+  cut_rows = run_starts[np.minimum(cut_runs, run_starts.size - 1)]
+  cuts = np.unique(np.r_[0, cut_rows, users.size])
+  shards = list(zip(cuts[:-1], cuts[1:]))
+
+  with tempfile.TemporaryDirectory(dir=tmp_dir) as shard_dir:
+    np.save(os.path.join(shard_dir, "users.npy"), users)
+    np.save(os.path.join(shard_dir, "books.npy"), books)
+    del users, books
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+      futures = [
+        pool.submit(
+          _count_pairs_shard,
+          shard_dir, shard_id, int(lo), int(hi), num_books, max_books_per_user,
+        )
+        for shard_id, (lo, hi) in enumerate(shards)
+      ]
+      shard_ids = [f.result() for f in futures]
+
+    # Merge the sorted partial counts, shards are read through memory maps
+    keys = np.concatenate([
+      np.load(os.path.join(shard_dir, f"keys_{i}.npy"), mmap_mode="r")
+      for i in shard_ids
+    ])
+    counts = np.concatenate([
+      np.load(os.path.join(shard_dir, f"counts_{i}.npy"), mmap_mode="r")
+      for i in shard_ids
+    ])
+
+  keys, counts = reduce_pair_counts(keys, counts)
+  return keys // num_books, keys % num_books, counts
+
+# Count book co-occurrences as the off-diagonal upper triangle of B^T B,
+# where B is the binary user x book incidence matrix.
+# The product is computed block_size books at a time (B[:, block]^T @ B), so
+# only one block of the co-occurrence matrix is in memory at once, and the
+# min_weight pruning is applied to each block before it is kept.
+def count_cooccurrence_pairs_sparse(
+  user_idx,
+  book_idx,
+  max_books_per_user=None,
+  min_weight=1,
+  block_size=20_000,
+):
+  user_idx = np.asarray(user_idx, dtype=np.int64)
+  book_idx = np.asarray(book_idx, dtype=np.int64)
+  empty = np.empty(0, dtype=np.int64)
+  if book_idx.size == 0:
+    return empty, empty, empty
+
+  # Binary incidence matrix, duplicates (user, book) rows collapse to 1
+  num_users = int(user_idx.max()) + 1
+  num_books = int(book_idx.max()) + 1
+  incidence = sp.csr_matrix(
+    (np.ones(user_idx.size, dtype=np.int64), (user_idx, book_idx)),
+    shape=(num_users, num_books),
+  )
+  incidence.data[:] = 1
+
+  # Drop users with fewer than 2 books and heavy users (whole rows of B)
+  books_per_user = np.diff(incidence.indptr)
+  keep_users = books_per_user >= 2
+  if max_books_per_user is not None:
+    keep_users &= books_per_user <= max_books_per_user
+  incidence = incidence[keep_users]
+  incidence_t = incidence.T.tocsr()
+
+  src_parts, dst_parts, weight_parts = [], [], []
+  for lo in range(0, num_books, block_size):
+    hi = min(lo + block_size, num_books)
+    # Co-occurrence counts of books lo..hi-1 with every book
+    block = (incidence_t[lo:hi] @ incidence).tocoo()
+    rows = block.row.astype(np.int64) + lo
+    cols = block.col.astype(np.int64)
+    # Keep the upper triangle (i < j) and apply min_weight on the block
+    keep = cols > rows
+    if min_weight is not None and min_weight > 1:
+      keep &= block.data >= min_weight
+    rows, cols, data = rows[keep], cols[keep], block.data[keep]
+    # Sort the block by (src, dst) so the output order is deterministic
+    order = np.lexsort((cols, rows))
+    src_parts.append(rows[order])
+    dst_parts.append(cols[order])
+    weight_parts.append(data[order].astype(np.int64))
+
+  return (
+    np.concatenate(src_parts),
+    np.concatenate(dst_parts),
+    np.concatenate(weight_parts),
+  )
+
+# Pair keys (i * num_books + j, i < j) of one tile: the books of chunk a
+# with the books of chunk b >= a of one user's sorted book list.
+def _tile_pair_keys(books, num_books, lo_a, hi_a, lo_b, hi_b):
+  chunk_a = books[lo_a:hi_a]
+  if lo_a == lo_b:
+    left, right = np.triu_indices(chunk_a.size, k=1)
+    return chunk_a[left] * num_books + chunk_a[right]
+  chunk_b = books[lo_b:hi_b]
+  return (chunk_a[:, None] * num_books + chunk_b[None, :]).ravel()
+
+# Worker of count_heavy_user_pairs: count the pairs of a group of tiles of one
+# user, at most about batch_size keys are in memory at once
+def _count_tile_group(books, num_books, tiles, weight):
+  keys = np.concatenate([
+    _tile_pair_keys(books, num_books, *tile) for tile in tiles
+  ])
+  return reduce_pair_counts(keys, np.full(keys.size, weight))
+
+# Merge the partial (keys, counts) of the tile groups, reducing every time
+# about batch_size keys are buffered
+def _merge_tile_counts(results, weight_dtype, batch_size):
+  keys_acc = np.empty(0, dtype=np.int64)
+  counts_acc = np.empty(0, dtype=weight_dtype)
+  buffer_keys, buffer_counts = [], []
+  buffered = 0
+  for keys, counts in results:
+    buffer_keys.append(keys)
+    buffer_counts.append(counts)
+    buffered += keys.size
+    if buffered >= batch_size:
+      keys_acc, counts_acc = reduce_pair_counts(
+        np.concatenate([keys_acc] + buffer_keys),
+        np.concatenate([counts_acc] + buffer_counts),
+      )
+      buffer_keys, buffer_counts = [], []
+      buffered = 0
+  if buffer_keys:
+    keys_acc, counts_acc = reduce_pair_counts(
+      np.concatenate([keys_acc] + buffer_keys),
+      np.concatenate([counts_acc] + buffer_counts),
+    )
+  return keys_acc, counts_acc
+
+# Count the pairs of heavy users (more than max_books_per_user books) without
+# ever materialising all the pairs of one user: the sorted book list of each
+# heavy user is cut in chunks of tile_size books and the pairs are generated
+# one tile (chunk x chunk) at a time. Tiles are grouped in tasks of about
+# batch_size pairs and run in a process pool when workers > 1.
+# With normalize=True each pair of a user with n books counts 1 / (n - 1).
+# Returns src, dst, weights sorted by (src, dst) and a dict of metrics.
+def count_heavy_user_pairs(
+  user_idx,
+  book_idx,
+  max_books_per_user,
+  tile_size=1024,
+  normalize=False,
+  workers=None,
+  batch_size=5_000_000,
+):
+  user_idx = np.asarray(user_idx, dtype=np.int64)
+  book_idx = np.asarray(book_idx, dtype=np.int64)
+  weight_dtype = float if normalize else np.int64
+  empty = np.empty(0, dtype=np.int64)
+  metrics = {
+    "heavy_users": 0,
+    "heavy_user_pairs": 0,
+    "light_user_pairs": 0,
+    "heavy_tiles": 0,
+  }
+  if book_idx.size == 0:
+    return empty, empty, np.empty(0, dtype=weight_dtype), metrics
+
+  # Deduplicate (user, book) rows and sort them by user, then book
+  num_books = int(book_idx.max()) + 1
+  rows = np.unique(user_idx * num_books + book_idx)
+  users = rows // num_books
+  books = rows % num_books
+  run_starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+  run_lengths = np.diff(np.r_[run_starts, rows.size])
+
+  pairs_per_user = run_lengths * (run_lengths - 1) // 2
+  heavy = run_lengths > max_books_per_user
+  metrics["heavy_users"] = int(heavy.sum())
+  metrics["heavy_user_pairs"] = int(pairs_per_user[heavy].sum())
+  metrics["light_user_pairs"] = int(pairs_per_user[~heavy].sum())
+
+  # Tasks: (books of the user, group of tiles, weight of each pair)
+  tiles_per_task = max(1, batch_size // (tile_size * tile_size))
+  tasks = []
+  for start, length in zip(run_starts[heavy], run_lengths[heavy]):
+    user_books = books[start:start + length]
+    weight = 1.0 / (length - 1) if normalize else 1
+    chunks = [(lo, min(lo + tile_size, length)) for lo in range(0, length, tile_size)]
+    tiles = [
+      (lo_a, hi_a, lo_b, hi_b)
+      for a, (lo_a, hi_a) in enumerate(chunks)
+      for lo_b, hi_b in chunks[a:]
+    ]
+    metrics["heavy_tiles"] += len(tiles)
+    for t in range(0, len(tiles), tiles_per_task):
+      tasks.append((user_books, tiles[t:t + tiles_per_task], weight))
+
+  if workers is not None and workers > 1 and len(tasks) > 1:
+    # The pool is shut down (workers included) even if a task or the merge raises
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+      results = pool.map(
+        _count_tile_group,
+        *zip(*[(b, num_books, tiles, w) for b, tiles, w in tasks]),
+      )
+      keys_acc, counts_acc = _merge_tile_counts(results, weight_dtype, batch_size)
+  else:
+    results = (
+      _count_tile_group(b, num_books, tiles, w) for b, tiles, w in tasks
+    )
+    keys_acc, counts_acc = _merge_tile_counts(results, weight_dtype, batch_size)
+
+  return keys_acc // num_books, keys_acc % num_books, counts_acc, metrics
+
+# Add the heavy user pairs to an edge list: weights of the same (src, dst)
+# are summed, the result is sorted by (src, dst).
+# Also returns the number of edges that only exist because of heavy users.
+def _merge_edge_counts(edges_df, src_nodes, dst_nodes, weights):
+  edge_src = edges_df["src_book_idx"].to_numpy(dtype=np.int64)
+  edge_dst = edges_df["dst_book_idx"].to_numpy(dtype=np.int64)
+  num_books = int(max(
+    edge_src.max(initial=-1), edge_dst.max(initial=-1),
+    src_nodes.max(initial=-1), dst_nodes.max(initial=-1),
+  )) + 1
+  light_keys = edge_src * num_books + edge_dst
+  heavy_keys = src_nodes * num_books + dst_nodes
+  keys, counts = reduce_pair_counts(
+    np.concatenate([light_keys, heavy_keys]),
+    np.concatenate([edges_df["weight"].to_numpy(), weights]),
+  )
+  merged = pd.DataFrame({
+    "src_book_idx": keys // num_books,
+    "dst_book_idx": keys % num_books,
+    "weight": counts,
+  })
+  heavy_only_edges = int(np.isin(heavy_keys, light_keys, invert=True).sum())
+  return merged, heavy_only_edges
+
+# Count co-occurrences with a Python loop over users and a Counter of pairs
+def _build_edges_counter(df_indexed, max_books_per_user):
   # Counter to store edge weights (i,j)
   # We will always store edges with (i < j) to represent an undirected edge.
   edge_counter = Counter()
@@ -60,27 +668,231 @@ def build_book_cooccurrence_edges(
     })
   
   else:
-    # Edge case: no edges created
-    edges_df = pd.DataFrame(
-      columns = ["src_book_idx", "dst_book_idx", "weight"]
+    # Edge case: no edges created (int64 columns like the other builders,
+    # so the empty table can still be saved as npy)
+    edges_df = pd.DataFrame({
+      "src_book_idx": np.empty(0, dtype=np.int64),
+      "dst_book_idx": np.empty(0, dtype=np.int64),
+      "weight": np.empty(0, dtype=np.int64),
+    })
+
+  return edges_df
+
+# Read an indexed ratings file sorted by user_idx chunk by chunk and yield
+# (user_idx, sorted unique book_idx array) for every user, without loading the
+# whole file. The last user of a chunk is carried over to the next one, since
+# its rows can continue there. CSV and Parquet files are supported.
+def iter_user_book_sets(path, chunksize=500_000):
+  columns = ["user_idx", "book_idx"]
+  if storage_format_of(path) == "parquet":
+    # Optional dependency, only needed to read Parquet in batches
+    import pyarrow.parquet as pq
+    chunks = (
+      batch.to_pandas()
+      for batch in pq.ParquetFile(path).iter_batches(
+        batch_size=chunksize, columns=columns)
     )
-  
-  # Filter edges by minimum weight
-  if min_weight is not None and min_weight > 1 and not edges_df.empty:
-    before = len(edges_df)
-    edges_df = edges_df[edges_df["weight"] >= min_weight].copy()
-    after = len(edges_df)
+  else:
+    chunks = pd.read_csv(path, usecols=columns, chunksize=chunksize)
+
+  carry_user = None
+  carry_books = []
+  for chunk in chunks:
+    users = chunk["user_idx"].to_numpy(dtype=np.int64)
+    books = chunk["book_idx"].to_numpy(dtype=np.int64)
+    if users.size == 0:
+      continue
+    if (np.diff(users) < 0).any() or (carry_user is not None and users[0] < carry_user):
+      raise ValueError(
+        f"[iter_user_book_sets] {path} is not sorted by user_idx "
+        "(build_id_mappings and build_indexed_core write it sorted).")
+
+    run_starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    run_ends = np.r_[run_starts[1:], users.size]
+    for start, end in zip(run_starts, run_ends):
+      user = users[start]
+      if user != carry_user:
+        if carry_user is not None:
+          yield carry_user, np.unique(np.concatenate(carry_books))
+        carry_user = user
+        carry_books = []
+      carry_books.append(books[start:end])
+
+  if carry_user is not None:
+    yield carry_user, np.unique(np.concatenate(carry_books))
+
+# Write one sorted run of (pair key, count) to disk and return its paths
+def _spill_pair_run(run_dir, run_id, keys, counts):
+  keys_path = os.path.join(run_dir, f"run_{run_id}_keys.npy")
+  counts_path = os.path.join(run_dir, f"run_{run_id}_counts.npy")
+  np.save(keys_path, keys)
+  np.save(counts_path, counts)
+  return keys_path, counts_path
+
+# k-way merge of sorted runs with a heap. Runs are memory-mapped and read
+# block_size entries at a time. The heap holds the last key of the current
+# block of every run: every key up to the smallest of them is complete in
+# the loaded blocks, so that part is reduced and emitted, and the run that
+# owns the smallest block end loads its next block.
+# Yields (keys, counts) blocks in increasing key order, summed over the runs.
+def _merge_pair_runs(runs, block_size):
+  keys_runs = [np.load(k, mmap_mode="r") for k, _ in runs]
+  counts_runs = [np.load(c, mmap_mode="r") for _, c in runs]
+  positions = [0] * len(runs)
+  block_ends = [0] * len(runs)
+
+  heap = []
+  for run_id, keys in enumerate(keys_runs):
+    if keys.size:
+      block_ends[run_id] = min(block_size, keys.size)
+      heapq.heappush(heap, (int(keys[block_ends[run_id] - 1]), run_id))
+
+  while heap:
+    bound, bound_run = heapq.heappop(heap)
+    # A run can already be consumed up to bound when block ends are equal
+    keys_parts = [np.empty(0, dtype=np.int64)]
+    counts_parts = [np.empty(0, dtype=np.int64)]
+    for run_id, keys in enumerate(keys_runs):
+      lo, hi = positions[run_id], block_ends[run_id]
+      if lo >= hi:
+        continue
+      # Entries of the loaded block with key <= bound
+      cut = lo + int(np.searchsorted(keys[lo:hi], bound, side="right"))
+      keys_parts.append(np.asarray(keys[lo:cut]))
+      counts_parts.append(np.asarray(counts_runs[run_id][lo:cut]))
+      positions[run_id] = cut
+    yield reduce_pair_counts(np.concatenate(keys_parts), np.concatenate(counts_parts))
+
+    # The run of the bound has used its whole block, load the next one
+    if positions[bound_run] < keys_runs[bound_run].size:
+      block_ends[bound_run] = min(positions[bound_run] + block_size,
+                                  keys_runs[bound_run].size)
+      heapq.heappush(
+        heap, (int(keys_runs[bound_run][block_ends[bound_run] - 1]), bound_run))
+
+# Count co-occurrences from a stream of (user_idx, books) pairs (e.g.
+# iter_user_book_sets) with external memory. Users are grouped until
+# group_rows books are pending, then the pairs of the group are generated by
+# _pair_key_batches with keys i << 32 | j (no need to know the number of books
+# in advance). Keys are buffered until about memory_budget bytes are in use,
+# then reduced and spilled to a sorted run on disk. The runs are combined
+# with _merge_pair_runs and min_weight is applied while merging.
+# Returns src, dst, counts sorted by (src, dst).
+def count_cooccurrence_pairs_external(
+  user_book_sets,
+  max_books_per_user=None,
+  min_weight=1,
+  memory_budget=256 * 2**20,
+  group_rows=100_000,
+  tmp_dir=None,
+):
+  # About 4 arrays of 8 bytes per buffered key while a run is reduced
+  max_buffered = max(100_000, memory_budget // 32)
+  empty = np.empty(0, dtype=np.int64)
+
+  with tempfile.TemporaryDirectory(dir=tmp_dir) as run_dir:
+    runs = []
+    buffer_keys = []
+    buffered = 0
+    group_books = []
+    group_lengths = []
+    pending_rows = 0
+    num_users = 0
+    total_pairs = 0
+
+    def spill():
+      nonlocal buffer_keys, buffered
+      keys, counts = reduce_pair_counts(
+        np.concatenate(buffer_keys), np.ones(buffered, dtype=np.int64))
+      runs.append(_spill_pair_run(run_dir, len(runs), keys, counts))
+      buffer_keys = []
+      buffered = 0
+
+    def emit_group():
+      nonlocal buffered, total_pairs
+      books = np.concatenate(group_books).astype(np.int64, copy=False)
+      run_lengths = np.array(group_lengths, dtype=np.int64)
+      for batch_keys in _pair_key_batches(books, run_lengths, 1 << 32, max_buffered):
+        buffer_keys.append(batch_keys)
+        buffered += batch_keys.size
+        total_pairs += batch_keys.size
+        if buffered >= max_buffered:
+          spill()
+
+    for _, books in user_book_sets:
+      num_users += 1
+      if books.size < 2:
+        continue
+      if max_books_per_user is not None and books.size > max_books_per_user:
+        continue
+      group_books.append(books)
+      group_lengths.append(books.size)
+      pending_rows += books.size
+      if pending_rows >= group_rows:
+        emit_group()
+        group_books, group_lengths, pending_rows = [], [], 0
+
+    if group_books:
+      emit_group()
+    if buffer_keys:
+      spill()
+
     print(
-      f"[build_book_cooccurrence_edges] Filtered edges with weight < {min_weight}: "
-      f"{before} -> {after}"
+      f"[count_cooccurrence_pairs_external] {num_users} users, "
+      f"{total_pairs} pairs spilled to {len(runs)} sorted runs"
     )
-  
-  print("\n[build_book_cooccurrence_edges] Edge list (first rows):")
-  print(edges_df.head())
 
-  # Save the edge list to CSV
-  edges_path = os.path.join(processed_dir, save_name)
-  edges_df.to_csv(edges_path, index=False)
-  print(f"[build_book_cooccurrence_edges] Edge list saved in: {edges_path}")
+    # The merge holds about one block per run
+    block_size = max(1, max_buffered // max(1, len(runs)))
+    keys_parts, counts_parts = [empty], [empty]
+    for keys, counts in _merge_pair_runs(runs, block_size):
+      if min_weight is not None and min_weight > 1:
+        keep = counts >= min_weight
+        keys, counts = keys[keep], counts[keep]
+      keys_parts.append(keys)
+      counts_parts.append(counts)
+
+  keys = np.concatenate(keys_parts)
+  counts = np.concatenate(counts_parts)
+  return keys >> 32, keys & 0xFFFFFFFF, counts
+
+# Build the co-occurrence edge list from an indexed ratings file sorted by
+# user_idx (as written by build_id_mappings / build_indexed_core), without
+# loading it in memory: users are streamed by iter_user_book_sets and the
+# pairs counted by count_cooccurrence_pairs_external. Same edges and saving
+# as build_book_cooccurrence_edges.
+def build_book_cooccurrence_edges_streaming(
+  ratings_indexed_path,
+  processed_dir,
+  save_name="edges_books_core_small.csv",
+  max_books_per_user=None,
+  min_weight=1,
+  memory_budget=256 * 2**20,
+  chunksize=500_000,
+  storage_format="csv",
+  compact=False,
+):
+  ensure_dirs([processed_dir])
+  print("\n[build_book_cooccurrence_edges_streaming] Building book co-occurrence "
+        f"graph from {ratings_indexed_path}...")
+
+  src_nodes, dst_nodes, weights = count_cooccurrence_pairs_external(
+    iter_user_book_sets(ratings_indexed_path, chunksize=chunksize),
+    max_books_per_user=max_books_per_user,
+    min_weight=min_weight,
+    memory_budget=memory_budget,
+    tmp_dir=processed_dir,
+  )
+  edges_df = pd.DataFrame({
+    "src_book_idx": src_nodes,
+    "dst_book_idx": dst_nodes,
+    "weight": weights,
+  })
+  if compact:
+    edges_df = compact_edges(edges_df)
+  print(f"[build_book_cooccurrence_edges_streaming] Number of edges: {len(edges_df)}")
+
+  edges_path = save_table(edges_df, processed_dir, save_name, storage_format)
+  print(f"[build_book_cooccurrence_edges_streaming] Edge list saved in: {edges_path}")
 
-  return edges_df
\ No newline at end of file
+  return edges_df
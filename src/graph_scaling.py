@@ -1,14 +1,115 @@
 import os
 import time
+import tracemalloc
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 
 from src.preprocessing import build_core_subset
 from src.mapping_ids import build_id_mappings
 from src.graph_construction import build_book_cooccurrence_edges
-from src.pagerank import pagerank_power_iteration
+from src.pagerank import (build_transition_matrix, map_ranks_to_mapping,
+    pagerank_power_iteration,)
 from src.debug_utils import run_all_sanity_checks
+from src.storage import load_table, save_table, table_path
+from src.artifact_cache import (cache_key, cache_put, cache_read,
+    dataframe_fingerprint, evict_lru,)
+
+# Write the mappings and the edge list of a config into a cache entry.
+# Entries are always npy, whatever the storage_format of the run: csv would
+# turn string ids such as "0000000123" into integers on the way back, and
+# map_ranks_to_mapping would no longer find them for the warm start.
+def _write_graph_entry(entry_dir, user_mapping, book_mapping, df_indexed,
+                       edges_df):
+  save_table(user_mapping, entry_dir, "user_mapping.csv", "npy")
+  save_table(book_mapping, entry_dir, "book_mapping.csv", "npy")
+  save_table(df_indexed, entry_dir, "ratings_indexed.csv", "npy")
+  save_table(edges_df, entry_dir, "edges.csv", "npy")
+
+# Read back a cache entry written by _write_graph_entry
+def _read_graph_entry(entry_dir):
+  user_mapping = load_table(table_path(entry_dir, "user_mapping.csv", "npy"))
+  book_mapping = load_table(table_path(entry_dir, "book_mapping.csv", "npy"))
+  df_indexed = load_table(table_path(entry_dir, "ratings_indexed.csv", "npy"))
+  edges_df = load_table(table_path(entry_dir, "edges.csv", "npy"))
+  return user_mapping, book_mapping, df_indexed, edges_df
+
+# Transition matrix of a cached graph, built and cached on first use.
+# Returns the matrix and whether it came from the cache.
+def _cached_transition(processed_dir, graph_key, num_nodes, src_nodes,
+                       dst_nodes, edge_weights, weighted, compact):
+  csr_key = cache_key(graph_key, artifact="csr", weighted=weighted, compact=compact)
+  transition = cache_read(
+    processed_dir, csr_key,
+    lambda entry_dir: sp.load_npz(os.path.join(entry_dir, "transition.npz")))
+  if transition is not None:
+    return transition, True
+
+  transition, _ = build_transition_matrix(
+    num_nodes, src_nodes, dst_nodes, weights=edge_weights, symmetric=True,
+    dtype=np.float32 if compact else float)
+  cache_put(
+    processed_dir,
+    csr_key,
+    lambda tmp_dir: sp.save_npz(
+      os.path.join(tmp_dir, "transition.npz"), transition, compressed=False),
+    params={"graph_key": graph_key, "weighted": weighted, "compact": compact},
+  )
+  return transition, False
+
+# Build the core subset, the index mappings and the co-occurrence edges of
+# one config, as in the original pipeline (tables saved in processed_dir)
+def _build_config_graph(
+  df_core,
+  processed_dir,
+  config_name,
+  max_users,
+  max_books_per_user,
+  min_weight,
+  storage_format,
+  edges_format,
+  mapping_method,
+  compact,
+):
+  # Build core subset
+  subset_name = f"ratings_core_{config_name}_for_graph.csv"
+  df_core_sub = build_core_subset(
+    df_core=df_core,
+    processed_dir=processed_dir,
+    max_users=max_users,
+    save_name=subset_name,
+    storage_format=storage_format,)
+  
+  # Build index mappings
+  user_mapping_name = f"user_id_mapping_{config_name}.csv"
+  book_mapping_name = f"book_id_mapping_{config_name}.csv"
+  ratings_indexed_name = f"ratings_core_{config_name}_indexed.csv"
+
+  user_mapping, book_mapping, df_indexed = build_id_mappings(
+    df_core_small=df_core_sub,
+    processed_dir=processed_dir,
+    user_mapping_name=user_mapping_name,
+    book_mapping_name=book_mapping_name,
+    ratings_indexed_name=ratings_indexed_name,
+    storage_format=storage_format,
+    method=mapping_method,
+    compact=compact,)
+  
+  # Build cooccurrence graph and measure time
+  t_graph_start = time.perf_counter()
+  edges_df = build_book_cooccurrence_edges(
+    df_indexed=df_indexed,
+    processed_dir=processed_dir,
+    save_name=f"edges_books_core_{config_name}.csv",
+    max_books_per_user=max_books_per_user,
+    min_weight=min_weight,
+    storage_format=edges_format,
+    compact=compact,)
+  t_graph_end = time.perf_counter()
+  graph_build_time = t_graph_end - t_graph_start
+
+  return df_core_sub, user_mapping, book_mapping, df_indexed, edges_df, graph_build_time
 
 # Run graph and pagerank scaling experiments for a list of configs.
 def run_scaling_experiments(
@@ -20,52 +121,78 @@ def run_scaling_experiments(
     damping=0.85,
     tol=1e-6,
     max_iter=100,
+    weighted=False,
+    pagerank_engine="edges",
+    n_threads=None,
+    warm_start=False,
+    storage_format="csv",
+    edges_format=None,
+    mapping_method="merge",
+    compact=False,
+    use_cache=False,
+    cache_max_bytes=2 * 2**30,
     verbose_pagerank=False,
     run_sanity_checks_flag=True,
     save_results=True,
     results_filename="graph_scaling_summary.csv",
 ):
 
+  # Edge lists can use npy even when the other tables need csv/parquet
+  edges_format = edges_format or storage_format
   records = []
+  # Mapping and ranks of the previous config, used for warm starts
+  prev_book_mapping = None
+  prev_ranks = None
+  # Cache keys start from the content of df_core, so min_reviews and any
+  # other filtering done before this function is part of the key
+  core_fingerprint = dataframe_fingerprint(df_core) if use_cache else None
 
   for cfg in configs:
     config_name = cfg["name"]
     max_users = cfg["max_users"]
     print(f"\n[scaling] running config {config_name} with max_users={max_users}")
 
-    # Build core subset
-    subset_name = f"ratings_core_{config_name}_for_graph.csv"
-    df_core_sub = build_core_subset(
-      df_core=df_core,
-      processed_dir=processed_dir,
-      max_users=max_users,
-      save_name=subset_name,)
-    
-    # Build index mappings
-    user_mapping_name = f"user_id_mapping_{config_name}.csv"
-    book_mapping_name = f"book_id_mapping_{config_name}.csv"
-    ratings_indexed_name = f"ratings_core_{config_name}_indexed.csv"
-
-    user_mapping, book_mapping, df_indexed = build_id_mappings(
-      df_core_small=df_core_sub,
-      processed_dir=processed_dir,
-      user_mapping_name=user_mapping_name,
-      book_mapping_name=book_mapping_name,
-      ratings_indexed_name=ratings_indexed_name,)
-    
-    # Build cooccurrence graph and measure time
-    t_graph_start = time.perf_counter()
-    edges_df = build_book_cooccurrence_edges(
-      df_indexed=df_indexed,
-      processed_dir=processed_dir,
-      save_name=f"edges_books_core_{config_name}.csv",
-      max_books_per_user=max_books_per_user,
-      min_weight=min_weight,)
-    t_graph_end = time.perf_counter()
-    graph_build_time = t_graph_end - t_graph_start
+    cache_hit = False
+    if use_cache:
+      graph_params = {
+        "artifact": "graph",
+        "max_users": max_users,
+        "max_books_per_user": max_books_per_user,
+        "min_weight": min_weight,
+        "mapping_method": mapping_method,
+        "compact": compact,
+        # Layout of the entry (see _write_graph_entry), not the run's format
+        "entry_format": "npy",
+      }
+      graph_key = cache_key(core_fingerprint, **graph_params)
+      # Reuse mappings and edges, the load time is reported as build time
+      t_graph_start = time.perf_counter()
+      cached_graph = cache_read(processed_dir, graph_key, _read_graph_entry)
+      t_graph_end = time.perf_counter()
+      cache_hit = cached_graph is not None
+
+    if cache_hit:
+      print(f"[scaling] config {config_name} found in cache")
+      user_mapping, book_mapping, df_indexed, edges_df = cached_graph
+      graph_build_time = t_graph_end - t_graph_start
+      df_core_sub = df_indexed.drop(columns=["user_idx", "book_idx"])
+    else:
+      df_core_sub, user_mapping, book_mapping, df_indexed, edges_df, graph_build_time = (
+        _build_config_graph(
+          df_core, processed_dir, config_name, max_users, max_books_per_user,
+          min_weight, storage_format, edges_format, mapping_method, compact))
+      if use_cache:
+        cache_put(
+          processed_dir,
+          graph_key,
+          lambda tmp_dir: _write_graph_entry(
+            tmp_dir, user_mapping, book_mapping, df_indexed, edges_df),
+          params=graph_params,
+        )
 
     num_nodes = len(book_mapping)
     num_edges = len(edges_df)
+    edges_memory_mb = edges_df.memory_usage(index=False).sum() / 2**20
 
     print(
       f"[scaling] config {config_name} "
@@ -73,6 +200,10 @@ def run_scaling_experiments(
       f"graph_build_time={graph_build_time:.4f} seconds"
     )
     pagerank_time = float("nan")
+    pagerank_iterations = np.nan
+    pagerank_peak_memory_mb = np.nan
+    transition_time = float("nan")
+    transition_cache_hit = False
 
     if run_sanity_checks_flag:
       run_all_sanity_checks(
@@ -87,39 +218,89 @@ def run_scaling_experiments(
       print(f"[scaling] config {config_name} has zero edges, skipping pagerank")
       pagerank_time=np.nan
     else:
-      # Build directed edges
-      src_nodes = np.concatenate(
-        [edges_df["src_book_idx"].values, edges_df["dst_book_idx"].values])
-      dst_nodes = np.concatenate(
-        [edges_df["dst_book_idx"].values, edges_df["src_book_idx"].values])
+      # The i < j edge list is passed as is: symmetric mode propagates rank
+      # in both directions without building the reversed copy
+      src_nodes = edges_df["src_book_idx"].values
+      dst_nodes = edges_df["dst_book_idx"].values
+      # Weighted mode: use co-occurrence counts as edge weights
+      edge_weights = edges_df["weight"].values if weighted else None
       
-      # Run PageRank and measure time
+      # The csr engines can reuse the transition matrix of a cached graph.
+      # It is loaded (or built and stored) before the PageRank measurement,
+      # its own time goes to transition_time_sec, so the disk I/O does not
+      # show up in pagerank_time_sec / pagerank_peak_memory_mb and cache hits
+      # and misses time the same work.
+      transition = None
+      if use_cache and pagerank_engine in ("csr", "threads"):
+        t_transition_start = time.perf_counter()
+        transition, transition_cache_hit = _cached_transition(
+          processed_dir, graph_key, num_nodes, src_nodes, dst_nodes,
+          edge_weights, weighted, compact)
+        transition_time = time.perf_counter() - t_transition_start
+
+      # Run PageRank and measure time (the warm start mapping is included)
+      # and peak memory allocated during the run (NumPy reports to tracemalloc)
+      tracemalloc.start()
       t_pr_start = time.perf_counter()
-      _ = pagerank_power_iteration(
+      init_ranks = None
+      if warm_start and prev_ranks is not None:
+        init_ranks = map_ranks_to_mapping(
+          prev_book_mapping, prev_ranks, book_mapping)
+      ranks, pr_info = pagerank_power_iteration(
         num_nodes=num_nodes,
         src_nodes=src_nodes,
         dst_nodes=dst_nodes,
         damping=damping,
         tol=tol,
         max_iter=max_iter,
-        verbose=verbose_pagerank,)
+        verbose=verbose_pagerank,
+        weights=edge_weights,
+        symmetric=True,
+        engine=pagerank_engine,
+        n_threads=n_threads,
+        init_ranks=init_ranks,
+        return_info=True,
+        compact=compact,
+        transition=transition,)
       t_pr_end = time.perf_counter()
+      _, peak_memory = tracemalloc.get_traced_memory()
+      tracemalloc.stop()
       pagerank_time = t_pr_end - t_pr_start
+      pagerank_peak_memory_mb = peak_memory / 2**20
+      pagerank_iterations = pr_info["iterations"]
+      prev_book_mapping = book_mapping
+      prev_ranks = ranks
       
       print(
         f"[scaling] config {config_name} "
-        f"pagerank_time={pagerank_time:.4f} seconds"
+        f"pagerank_time={pagerank_time:.4f} seconds "
+        f"iterations={pagerank_iterations} "
+        f"peak_memory={pagerank_peak_memory_mb:.1f} MB"
       )
     
     record = {
       "config_name": config_name,
       "max_users": max_users,
+      "weighted": weighted,
+      "pagerank_engine": pagerank_engine,
+      "warm_start": warm_start,
+      "compact": compact,
+      "cache_hit": cache_hit,
       "num_nodes": num_nodes,
       "num_edges": num_edges,
       "graph_build_time_sec": graph_build_time,
-      "pagerank_time_sec": pagerank_time,}
+      "pagerank_time_sec": pagerank_time,
+      "transition_time_sec": transition_time,
+      "transition_cache_hit": transition_cache_hit,
+      "pagerank_iterations": pagerank_iterations,
+      "edges_memory_mb": edges_memory_mb,
+      "pagerank_peak_memory_mb": pagerank_peak_memory_mb,}
     records.append(record)
 
+    # Keep the cache in data/processed under its size budget
+    if use_cache:
+      evict_lru(processed_dir, cache_max_bytes)
+
   df_scaling = pd.DataFrame.from_records(records)
   if save_results:
     os.makedirs(processed_dir, exist_ok=True)
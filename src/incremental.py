@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+from src.graph_construction import count_cooccurrence_pairs, reduce_pair_counts
+from src.pagerank import pagerank_power_iteration
+
+# Incremental pipeline: instead of rebuilding mappings, edges and ranks from
+# scratch when new reviews arrive, only the users touched by the new rows are
+# recomputed and PageRank is warm started from the previous ranks.
+# The edge list to update must be the unfiltered one (min_weight=1): pairs
+# dropped by min_weight have lost their counts and could not be updated.
+
+# Give indices to the users and books of df_delta that are not mapped yet.
+# New ids are appended after the existing indices (existing ones never move),
+# in sorted id order. Returns the updated mappings and df_delta with
+# user_idx/book_idx attached.
+def append_id_mappings(user_mapping, book_mapping, df_delta):
+  def extend(mapping, id_col, idx_col):
+    ids = df_delta[id_col]
+    new_ids = np.sort(ids[~ids.isin(mapping[id_col])].unique())
+    start = len(mapping)
+    new_idx = np.arange(start, start + len(new_ids))
+    appended = pd.DataFrame({
+      id_col: new_ids,
+      idx_col: new_idx.astype(mapping[idx_col].dtype),
+    })
+    print(f"[append_id_mappings] New {id_col}: {len(new_ids)}")
+    mapping = pd.concat([mapping, appended], ignore_index=True)
+    lookup = pd.Series(mapping[idx_col].to_numpy(), index=pd.Index(mapping[id_col]))
+    return mapping, lookup.loc[ids].to_numpy()
+
+  user_mapping, user_idx = extend(user_mapping, "user_id", "user_idx")
+  book_mapping, book_idx = extend(book_mapping, "book_id", "book_idx")
+  df_delta_indexed = df_delta.assign(user_idx=user_idx, book_idx=book_idx)
+  return user_mapping, book_mapping, df_delta_indexed
+
+# Compute how the co-occurrence counts change when df_delta_indexed is added.
+# For every user in the delta, the pairs of the old book set are removed and
+# the pairs of the new book set (old + new books) are added. This also covers
+# users that cross max_books_per_user and stop contributing.
+# Returns a DataFrame src_book_idx, dst_book_idx, weight with signed weights.
+def cooccurrence_delta(df_indexed, df_delta_indexed, max_books_per_user=None):
+  affected_users = df_delta_indexed["user_idx"].unique()
+  old_rows = df_indexed.loc[
+    df_indexed["user_idx"].isin(affected_users), ["user_idx", "book_idx"]]
+  new_rows = pd.concat(
+    [old_rows, df_delta_indexed[["user_idx", "book_idx"]]], ignore_index=True)
+  print(f"[cooccurrence_delta] Affected users: {len(affected_users)}")
+  if new_rows.empty:
+    # Empty batch: no pair changes
+    empty = np.empty(0, dtype=np.int64)
+    return pd.DataFrame({
+      "src_book_idx": empty,
+      "dst_book_idx": empty,
+      "weight": empty,
+    })
+
+  old_src, old_dst, old_count = count_cooccurrence_pairs(
+    old_rows["user_idx"].values, old_rows["book_idx"].values, max_books_per_user)
+  new_src, new_dst, new_count = count_cooccurrence_pairs(
+    new_rows["user_idx"].values, new_rows["book_idx"].values, max_books_per_user)
+
+  # Signed difference new - old, zero changes are dropped
+  num_books = int(new_rows["book_idx"].max()) + 1
+  keys, counts = reduce_pair_counts(
+    np.concatenate([new_src * num_books + new_dst, old_src * num_books + old_dst]),
+    np.concatenate([new_count, -old_count]),
+  )
+  changed = counts != 0
+  keys, counts = keys[changed], counts[changed]
+  print(f"[cooccurrence_delta] Changed pairs: {len(keys)}")
+
+  return pd.DataFrame({
+    "src_book_idx": keys // num_books,
+    "dst_book_idx": keys % num_books,
+    "weight": counts,
+  })
+
+# Add a signed edge delta to an edge list. Pairs whose weight drops to 0
+# disappear, min_weight is applied on the result. Rows are sorted by
+# (src_book_idx, dst_book_idx) as the vectorised builders do.
+def apply_edge_delta(edges_df, delta_df, min_weight=1):
+  src = np.concatenate([
+    edges_df["src_book_idx"].to_numpy(np.int64),
+    delta_df["src_book_idx"].to_numpy(np.int64),
+  ])
+  dst = np.concatenate([
+    edges_df["dst_book_idx"].to_numpy(np.int64),
+    delta_df["dst_book_idx"].to_numpy(np.int64),
+  ])
+  weights = np.concatenate([
+    edges_df["weight"].to_numpy(np.int64),
+    delta_df["weight"].to_numpy(np.int64),
+  ])
+  num_books = int(max(src.max(), dst.max())) + 1 if src.size else 1
+  keys, weights = reduce_pair_counts(src * num_books + dst, weights)
+
+  keep = weights >= max(min_weight or 1, 1)
+  keys, weights = keys[keep], weights[keep]
+  return pd.DataFrame({
+    "src_book_idx": keys // num_books,
+    "dst_book_idx": keys % num_books,
+    "weight": weights,
+  })
+
+# Run the whole incremental update for a batch of new (user, book) rows:
+# extend the mappings, update the edge list of the affected users only, and
+# recompute PageRank warm started from prev_ranks (new books get the mean
+# rank). Extra keyword arguments go to pagerank_power_iteration.
+def incremental_update(
+  user_mapping,
+  book_mapping,
+  df_indexed,
+  edges_df,
+  prev_ranks,
+  df_delta,
+  max_books_per_user=None,
+  min_weight=1,
+  weighted=False,
+  **pagerank_kwargs,
+):
+  print("\n[incremental_update] Applying a batch of new reviews...")
+  if len(df_delta) == 0:
+    # Nothing to apply, keep the current state and ranks
+    print("[incremental_update] Empty batch, nothing to update.")
+    return user_mapping, book_mapping, df_indexed, edges_df, np.asarray(prev_ranks)
+  user_mapping, book_mapping, df_delta_indexed = append_id_mappings(
+    user_mapping, book_mapping, df_delta)
+  delta_df = cooccurrence_delta(df_indexed, df_delta_indexed, max_books_per_user)
+  edges_df = apply_edge_delta(edges_df, delta_df)
+  df_indexed = pd.concat([df_indexed, df_delta_indexed], ignore_index=True)
+
+  # Warm start: indices of old books did not change, new books are appended
+  num_nodes = len(book_mapping)
+  prev_ranks = np.asarray(prev_ranks, dtype=float)
+  init_ranks = np.full(num_nodes, prev_ranks.mean())
+  init_ranks[:len(prev_ranks)] = prev_ranks
+
+  # min_weight only filters the graph given to PageRank, the stored edge
+  # list keeps every pair so that later updates stay exact
+  graph_df = edges_df
+  if min_weight is not None and min_weight > 1:
+    graph_df = edges_df[edges_df["weight"] >= min_weight]
+
+  ranks = pagerank_power_iteration(
+    num_nodes=num_nodes,
+    src_nodes=graph_df["src_book_idx"].values,
+    dst_nodes=graph_df["dst_book_idx"].values,
+    weights=graph_df["weight"].values if weighted else None,
+    symmetric=True,
+    init_ranks=init_ranks,
+    **pagerank_kwargs,
+  )
+  return user_mapping, book_mapping, df_indexed, edges_df, ranks
@@ -2,11 +2,60 @@ import os
 import numpy as np
 import pandas as pd
 from src.utils_io import ensure_dirs
+from src.storage import load_table, save_table, table_path
+from src.artifact_cache import cache_key, file_fingerprint
+
+# Columns of Books_rating.csv used by the pipeline, with their clean names
+# and explicit dtypes (review text columns are never parsed)
+RATINGS_COLUMNS = {
+  "User_id": "user_id",
+  "Id": "book_id",
+  "Title": "book_title",
+  "review/score": "rating",
+}
+RATINGS_DTYPES = {
+  "User_id": "string",
+  "Id": "string",
+  "Title": "string",
+  "review/score": "float32",
+}
 
 # Return the expected path for the ratingS CSV file.
 def ratings_file_path(raw_dir):
   return os.path.join(raw_dir, "Books_rating.csv")
 
+# Key of a clean ratings file: fingerprint of the raw file plus the parameters
+# of the cleaning. None when the raw file is not available.
+def _clean_ratings_key(ratings_path, **params):
+  if not os.path.exists(ratings_path):
+    return None
+  return cache_key(file_fingerprint(ratings_path), **params)
+
+# True if the clean file exists and was built with the given key. Without the
+# raw file (key None) any existing clean file is used, as before.
+def _clean_ratings_is_current(clean_path, key):
+  if not os.path.exists(clean_path):
+    return False
+  if key is None:
+    return True
+  key_path = clean_path + ".key"
+  if os.path.exists(key_path):
+    with open(key_path) as f:
+      if f.read().strip() == key:
+        return True
+  print(f"Cleaned ratings at {clean_path} were built from another input or "
+        "other parameters, rebuilding them.")
+  return False
+
+# Store the key next to the clean file (written atomically)
+def _write_clean_ratings_key(clean_path, key):
+  if key is None:
+    return
+  tmp_path = clean_path + ".key.tmp"
+  with open(tmp_path, "w") as f:
+    f.write(key)
+  os.replace(tmp_path, clean_path + ".key")
+
 # Download the dataset into raw_dir only if the ratings file does not already exist.
 def download_dataset(raw_dir, kaggle_dataset):
   ensure_dirs([raw_dir])
@@ -47,6 +96,7 @@ def load_ratings (
   seed = 42,
   save_subsample_name = "ratings_subsample.csv",
   save_clean_name = "ratings_subsample_clean.csv",
+  storage_format = "csv",
 ):
 
   # Make sure the processed_dir exists
@@ -54,11 +104,19 @@ def load_ratings (
   # Build the path to the ratings file
   ratings_path = ratings_file_path(raw_dir)
   # Build the path to the cleaned file in processed_dir
-  clean_path = os.path.join(processed_dir, save_clean_name)
-  # If we already have the cleaned file, just load it and return it
-  if os.path.exists(clean_path):
+  clean_path = table_path(processed_dir, save_clean_name, storage_format)
+  clean_key = _clean_ratings_key(
+    ratings_path,
+    loader="load_ratings",
+    use_subsample=use_subsample,
+    subsample_fraction=subsample_fraction if use_subsample else None,
+    seed=seed if use_subsample else None,
+  )
+  # If we already have the cleaned file (built from the same raw file with the
+  # same parameters), just load it and return it
+  if _clean_ratings_is_current(clean_path, clean_key):
       print(f"Found existing cleaned ratings at: {clean_path}")
-      df_ratings_clean = pd.read_csv(clean_path)
+      df_ratings_clean = load_table(clean_path)
       print("Shape df_ratings_clean (loaded from disk):", df_ratings_clean.shape)
       print(df_ratings_clean.head())
       return df_ratings_clean
@@ -81,8 +139,8 @@ def load_ratings (
     print(f"Subsampled dataset shape: {df_ratings.shape}")
 
     # Save the sampled dataset into the processed directory
-    subsample_path = os.path.join(processed_dir, save_subsample_name)
-    df_ratings.to_csv(subsample_path, index = False)
+    subsample_path = save_table(
+      df_ratings, processed_dir, save_subsample_name, storage_format)
     print(f"Subsample saved to: {subsample_path}")
   
   else:
@@ -104,8 +162,112 @@ def load_ratings (
   print(df_ratings_clean.head())
 
   # Save the cleaned dataset into the processed directory
-  clean_path = os.path.join(processed_dir, save_clean_name)
-  df_ratings_clean.to_csv(clean_path, index=False)
+  clean_path = save_table(
+    df_ratings_clean, processed_dir, save_clean_name, storage_format)
+  _write_clean_ratings_key(clean_path, clean_key)
   print(f"Clean subsample saved in: {clean_path}")
 
-  return df_ratings_clean
\ No newline at end of file
+  return df_ratings_clean
+
+# Streaming version of load_ratings: read only the four useful columns in
+# chunks, keep each row with probability subsample_fraction (Bernoulli
+# sampling, one random draw per row from a generator seeded with seed, so the
+# sample does not depend on chunksize) and append the kept rows to the clean
+# file chunk by chunk. Memory depends on chunksize, not on the file size.
+def load_ratings_streaming(
+  raw_dir,
+  processed_dir,
+  use_subsample=True,
+  subsample_fraction=0.05,
+  seed=42,
+  chunksize=500_000,
+  save_clean_name="ratings_subsample_clean.csv",
+  storage_format="csv",
+  return_df=True,
+):
+  if storage_format not in ("csv", "parquet"):
+    raise ValueError("storage_format must be 'csv' or 'parquet' for the ratings.")
+
+  ensure_dirs([processed_dir])
+  ratings_path = ratings_file_path(raw_dir)
+  clean_path = table_path(processed_dir, save_clean_name, storage_format)
+  # The Bernoulli sample does not depend on chunksize, so it is not in the key
+  clean_key = _clean_ratings_key(
+    ratings_path,
+    loader="load_ratings_streaming",
+    use_subsample=use_subsample,
+    subsample_fraction=subsample_fraction if use_subsample else None,
+    seed=seed if use_subsample else None,
+  )
+  # If we already have the cleaned file, just load it and return it
+  if _clean_ratings_is_current(clean_path, clean_key):
+    print(f"Found existing cleaned ratings at: {clean_path}")
+    return load_table(clean_path) if return_df else clean_path
+  if not os.path.exists(ratings_path):
+    raise FileNotFoundError(f"ERROR: ratings file not found at {ratings_path}")
+
+  if storage_format == "parquet":
+    # Optional dependency, only needed to write Parquet incrementally
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ratings_schema = pa.schema([
+      ("user_id", pa.string()),
+      ("book_id", pa.string()),
+      ("book_title", pa.string()),
+      ("rating", pa.float32()),
+    ])
+
+  rng = np.random.default_rng(seed)
+  reader = pd.read_csv(
+    ratings_path,
+    usecols=list(RATINGS_COLUMNS),
+    dtype=RATINGS_DTYPES,
+    chunksize=chunksize,
+  )
+  print(f"Streaming {ratings_path} in chunks of {chunksize} rows "
+        f"(subsample={use_subsample}, fraction={subsample_fraction})")
+
+  # Write to a temporary file first, so a crash never leaves a partial
+  # clean file that the shortcut above would pick up next time
+  tmp_path = clean_path + ".tmp"
+  parquet_writer = None
+  rows_read = 0
+  rows_kept = 0
+  try:
+    for chunk_id, chunk in enumerate(reader):
+      rows_read += len(chunk)
+      if use_subsample:
+        chunk = chunk[rng.random(len(chunk)) < subsample_fraction]
+      chunk = chunk.rename(columns=RATINGS_COLUMNS)[list(RATINGS_COLUMNS.values())]
+      rows_kept += len(chunk)
+
+      if storage_format == "csv":
+        # Header only with the first chunk, then append
+        chunk.to_csv(
+          tmp_path,
+          mode="w" if chunk_id == 0 else "a",
+          header=(chunk_id == 0),
+          index=False,
+        )
+      else:
+        if parquet_writer is None:
+          parquet_writer = pq.ParquetWriter(tmp_path, ratings_schema)
+        parquet_writer.write_table(pa.Table.from_pandas(
+          chunk, schema=ratings_schema, preserve_index=False))
+  finally:
+    if parquet_writer is not None:
+      parquet_writer.close()
+
+  if rows_read == 0:
+    raise ValueError(f"ERROR: no rows found in {ratings_path}")
+  os.replace(tmp_path, clean_path)
+  _write_clean_ratings_key(clean_path, clean_key)
+  print(f"Rows read: {rows_read}, rows kept: {rows_kept}")
+  print(f"Clean subsample saved in: {clean_path}")
+
+  if not return_df:
+    return clean_path
+  df_ratings_clean = load_table(clean_path)
+  print("Shape df_ratings_clean:", df_ratings_clean.shape)
+  print(df_ratings_clean.head())
+  return df_ratings_clean
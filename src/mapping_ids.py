@@ -1,8 +1,22 @@
-import os
 import numpy as np
 import pandas as pd
 
 from src.utils_io import ensure_dirs
+from src.storage import save_table
+
+# Methods available in build_id_mappings
+# "merge":     sorted unique ids joined back with two DataFrame merges
+# "factorize": int32 codes from pd.factorize(sort=True), no join at all
+MAPPING_METHODS = ("merge", "factorize")
+
+# Map a column of ids to int32 codes following the sorted order of the ids.
+# Returns the codes and the sorted unique ids (code i <-> uniques[i]).
+def factorize_ids(ids, name):
+  codes, uniques = pd.factorize(ids, sort=True)
+  # factorize marks missing ids with -1, the merge version fails on them too
+  if (codes < 0).any():
+    raise ValueError(f"[build_id_mappings] Missing {name} in the input data.")
+  return codes.astype(np.int32), uniques
 
 # Build integer index mappings for users and books starting from a small core rating database
 def build_id_mappings(
@@ -11,46 +25,78 @@ def build_id_mappings(
   user_mapping_name="user_id_mapping_small.csv",
   book_mapping_name="book_id_mapping_small.csv",
   ratings_indexed_name="ratings_core_mapping_small.csv",
+  storage_format="csv",
+  method="merge",
+  save_index_only=False,
+  compact=False,
 ):
+  if method not in MAPPING_METHODS:
+    raise ValueError(f"method must be one of {MAPPING_METHODS}, got {method!r}.")
+
   # Make sure the processed directory exists
   ensure_dirs([processed_dir])
   print("\n[build_id_mappings] Creating user/book integer index mappings...")
 
-  # Build the user_id - user_idx mapping (sorted for reproducibility)
-  unique_users = np.sort(df_core_small["user_id"].unique())
-  user_mapping = pd.DataFrame({
-    "user_id": unique_users,
-    "user_idx": np.arange(len(unique_users), dtype=int),
-  })
-
-  # Build the book_id - book_idx mapping
-  unique_books = np.sort(df_core_small["book_id"].unique())
-  book_mapping = pd.DataFrame({
-    "book_id": unique_books,
-    "book_idx": np.arange(len(unique_books), dtype=int),
-  })
-
-  # Merge these mappings into the dataset
-  df_indexed = df_core_small.merge(user_mapping, on="user_id", how="left")
-  df_indexed = df_indexed.merge(book_mapping, on="book_id", how="left")
-  # There must be no missing indices
-  if df_indexed["user_idx"].isna().any():
-      raise ValueError("[build_id_mappings] Missing user_idx after merge.")
-  if df_indexed["book_idx"].isna().any():
-      raise ValueError("[build_id_mappings] Missing book_idx after merge.")
-  
-  # After the merge indices might be float
-  df_indexed["user_idx"] = df_indexed["user_idx"].astype(int)
-  df_indexed["book_idx"] = df_indexed["book_idx"].astype(int)
+  if method == "factorize":
+    # Codes are attached to the ratings directly, same indices as the merge
+    user_codes, unique_users = factorize_ids(df_core_small["user_id"], "user_id")
+    book_codes, unique_books = factorize_ids(df_core_small["book_id"], "book_id")
+    user_mapping = pd.DataFrame({
+      "user_id": unique_users,
+      "user_idx": np.arange(len(unique_users), dtype=np.int32),
+    })
+    book_mapping = pd.DataFrame({
+      "book_id": unique_books,
+      "book_idx": np.arange(len(unique_books), dtype=np.int32),
+    })
+    df_indexed = df_core_small.assign(
+      user_idx=user_codes,
+      book_idx=book_codes,
+    ).reset_index(drop=True)
+  else:
+    # Compact mode: int32 indices like factorize instead of int64
+    index_dtype = np.int32 if compact else int
+    # Build the user_id - user_idx mapping (sorted for reproducibility)
+    unique_users = np.sort(df_core_small["user_id"].unique())
+    user_mapping = pd.DataFrame({
+      "user_id": unique_users,
+      "user_idx": np.arange(len(unique_users), dtype=index_dtype),
+    })
 
-  # Save outputs
-  user_mapping_path = os.path.join(processed_dir, user_mapping_name)
-  book_mapping_path = os.path.join(processed_dir, book_mapping_name)
-  indexed_ratings_path = os.path.join(processed_dir, ratings_indexed_name)
+    # Build the book_id - book_idx mapping
+    unique_books = np.sort(df_core_small["book_id"].unique())
+    book_mapping = pd.DataFrame({
+      "book_id": unique_books,
+      "book_idx": np.arange(len(unique_books), dtype=index_dtype),
+    })
 
-  user_mapping.to_csv(user_mapping_path, index=False)
-  book_mapping.to_csv(book_mapping_path, index=False)
-  df_indexed.to_csv(indexed_ratings_path, index=False)
+    # Merge these mappings into the dataset
+    df_indexed = df_core_small.merge(user_mapping, on="user_id", how="left")
+    df_indexed = df_indexed.merge(book_mapping, on="book_id", how="left")
+    # There must be no missing indices
+    if df_indexed["user_idx"].isna().any():
+        raise ValueError("[build_id_mappings] Missing user_idx after merge.")
+    if df_indexed["book_idx"].isna().any():
+        raise ValueError("[build_id_mappings] Missing book_idx after merge.")
+
+    # After the merge indices might be float
+    df_indexed["user_idx"] = df_indexed["user_idx"].astype(index_dtype)
+    df_indexed["book_idx"] = df_indexed["book_idx"].astype(index_dtype)
+
+  # Save outputs
+  user_mapping_path = save_table(
+    user_mapping, processed_dir, user_mapping_name, storage_format)
+  book_mapping_path = save_table(
+    book_mapping, processed_dir, book_mapping_name, storage_format)
+  # The graph builders (Python and Spark) only need the two index columns
+  df_indexed_to_save = df_indexed
+  if save_index_only:
+    df_indexed_to_save = df_indexed[["user_idx", "book_idx"]]
+  # Written sorted by user_idx (stable, so each user keeps its row order):
+  # build_book_cooccurrence_edges_streaming reads the file in that order
+  df_indexed_to_save = df_indexed_to_save.sort_values("user_idx", kind="stable")
+  indexed_ratings_path = save_table(
+    df_indexed_to_save, processed_dir, ratings_indexed_name, storage_format)
 
   print(f"[build_id_mappings] Saved user mapping:   {user_mapping_path}")
   print(f"[build_id_mappings] Saved book mapping:   {book_mapping_path}")
@@ -1,4 +1,282 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from src.storage import load_edge_arrays, load_npy_columns, table_path
+from src.pagerank_solvers import ACCELERATED_SOLVERS, solve_pagerank
+
+try:
+  # Compiled CSR mat-vec of scipy, y += A @ x written in place (GIL released).
+  # It lives in a private module, so it is optional.
+  from scipy.sparse._sparsetools import csr_matvec
+except ImportError:
+  # Same result through the public API if a scipy release moves it, with a
+  # temporary vector per call. indptr can be the slice of a row block.
+  def csr_matvec(n_row, n_col, indptr, indices, data, x, y):
+    lo, hi = indptr[0], indptr[-1]
+    rows = sp.csr_matrix(
+      (data[lo:hi], indices[lo:hi], indptr - lo), shape=(n_row, n_col))
+    y += rows @ x
+
+# Engines available in pagerank_power_iteration
+# "edges": gather/scatter over the edge list at every iteration
+# "csr":   sparse transition matrix built once, one mat-vec per iteration
+# "stream": edge arrays (e.g. memory-mapped .npy) read block by block at every
+#           iteration, only O(num_nodes) vectors stay in memory
+# "threads": csr rows split in blocks, each block multiplied in a thread pool
+PAGERANK_ENGINES = ("edges", "csr", "stream", "threads")
+
+# Solvers available in pagerank_power_iteration: plain power iteration
+# (any engine) or one of the accelerated solvers of src.pagerank_solvers
+PAGERANK_SOLVERS = ("power",) + ACCELERATED_SOLVERS
+
+# Compute the out-degree of each node, or its out-strength (sum of the
+# weights of its outgoing edges) when edge weights are given.
+# On the symmetrised co-occurrence graph the out-strength is the same
+# "strength" reported by graph_diagnostics.compute_node_statistics.
+# If dst_nodes is given the edges are undirected (i < j, each stored once)
+# and every edge counts for both of its endpoints.
+def compute_out_strength(num_nodes, src_nodes, weights=None, dst_nodes=None):
+  out_strength = np.bincount(
+    src_nodes,
+    weights=weights,
+    minlength=num_nodes,
+  ).astype(float)
+  if dst_nodes is not None:
+    out_strength += np.bincount(dst_nodes, weights=weights, minlength=num_nodes)
+  return out_strength
+
+# Check the edge weights and convert them to a float array
+def _as_edge_weights(weights, num_edges, dtype=float):
+  weights = np.asarray(weights, dtype=dtype)
+  if weights.shape[0] != num_edges:
+    raise ValueError("weights must have the same length as src_nodes/dst_nodes.")
+  if num_edges > 0 and weights.min() < 0:
+    raise ValueError("weights must be non-negative.")
+  return weights
+
+# Check a starting rank vector and return a normalised copy of it
+def _as_init_ranks(init_ranks, num_nodes):
+  init_ranks = np.asarray(init_ranks, dtype=float)
+  if init_ranks.shape != (num_nodes,):
+    raise ValueError("init_ranks must have one value per node.")
+  if init_ranks.min() < 0 or init_ranks.sum() <= 0:
+    raise ValueError("init_ranks must be non-negative with a positive sum.")
+  return init_ranks / init_ranks.sum()
+
+# Map the ranks of a previous run onto a new book mapping, to warm start
+# pagerank_power_iteration. Books are matched through book_id, books that were
+# not in the previous mapping get the mean of the previous ranks, and the
+# vector is renormalised to sum 1.
+def map_ranks_to_mapping(prev_book_mapping, prev_ranks, new_book_mapping):
+  prev_ranks = np.asarray(prev_ranks, dtype=float)
+  # Previous rank of every book, looked up by book_id
+  prev_by_id = pd.Series(
+    prev_ranks[prev_book_mapping["book_idx"].to_numpy()],
+    index=pd.Index(prev_book_mapping["book_id"]),
+  )
+  positions = prev_by_id.index.get_indexer(new_book_mapping["book_id"])
+
+  init_ranks = np.full(len(new_book_mapping), prev_ranks.mean())
+  found = positions >= 0
+  new_idx = new_book_mapping["book_idx"].to_numpy()
+  init_ranks[new_idx[found]] = prev_by_id.to_numpy()[positions[found]]
+  print(f"[map_ranks_to_mapping] Reused ranks for {found.sum()} of "
+        f"{len(new_book_mapping)} books, new books get the mean rank.")
+  return init_ranks / init_ranks.sum()
+
+# Yield (start, stop) bounds of consecutive blocks of block_size edges
+def _edge_blocks(num_edges, block_size):
+  for start in range(0, num_edges, block_size):
+    yield start, min(start + block_size, num_edges)
+
+# Read one block of the edge arrays into memory with the dtypes used in the loop
+def _read_edge_block(src_nodes, dst_nodes, weights, start, stop):
+  src_block = np.asarray(src_nodes[start:stop], dtype=np.int64)
+  dst_block = np.asarray(dst_nodes[start:stop], dtype=np.int64)
+  weight_block = None
+  if weights is not None:
+    weight_block = np.asarray(weights[start:stop], dtype=float)
+  return src_block, dst_block, weight_block
+
+# Same as compute_out_strength, reading the edges one block at a time
+def _stream_out_strength(
+  num_nodes,
+  src_nodes,
+  dst_nodes,
+  weights,
+  symmetric,
+  block_size,
+):
+  out_strength = np.zeros(num_nodes, dtype=float)
+  for start, stop in _edge_blocks(src_nodes.shape[0], block_size):
+    src_block, dst_block, weight_block = _read_edge_block(
+      src_nodes, dst_nodes, weights, start, stop)
+    if weight_block is not None and weight_block.min() < 0:
+      raise ValueError("weights must be non-negative.")
+    out_strength += compute_out_strength(
+      num_nodes, src_block, weight_block, dst_block if symmetric else None)
+  return out_strength
+
+# Add the contributions of the values scattered to targets into link_contrib.
+# Only the index range covered by the block is touched, which is small when
+# the edge file is sorted by the target column.
+def _scatter_block(link_contrib, targets, values):
+  lo = targets.min()
+  hi = targets.max() + 1
+  link_contrib[lo:hi] += np.bincount(targets - lo, weights=values, minlength=hi - lo)
+
+# Link contribution of one iteration, streaming the edges block by block.
+# rank_share holds ranks_old / out_degree (0 for dangling nodes).
+def _stream_link_contrib(
+  num_nodes,
+  src_nodes,
+  dst_nodes,
+  weights,
+  symmetric,
+  block_size,
+  rank_share,
+):
+  link_contrib = np.zeros(num_nodes, dtype=float)
+  for start, stop in _edge_blocks(src_nodes.shape[0], block_size):
+    src_block, dst_block, weight_block = _read_edge_block(
+      src_nodes, dst_nodes, weights, start, stop)
+    # Direction src -> dst
+    contrib = rank_share[src_block]
+    if weight_block is not None:
+      contrib *= weight_block
+    _scatter_block(link_contrib, dst_block, contrib)
+    if symmetric:
+      # Direction dst -> src on the same block
+      contrib = rank_share[dst_block]
+      if weight_block is not None:
+        contrib *= weight_block
+      _scatter_block(link_contrib, src_block, contrib)
+  return link_contrib
+
+# Split the rows of a CSR matrix into n_blocks blocks with about the same
+# number of stored values. A block is (row_lo, row_hi, indptr view), so the
+# threaded mat-vec allocates nothing inside the power loop.
+def _plan_row_blocks(matrix, n_blocks):
+  num_rows = matrix.shape[0]
+  indptr = matrix.indptr
+  targets = indptr[-1] * np.arange(1, n_blocks) / n_blocks
+  cuts = np.unique(np.r_[0, np.searchsorted(indptr, targets), num_rows])
+  return [
+    (row_lo, row_hi, indptr[row_lo:row_hi + 1])
+    for row_lo, row_hi in zip(cuts[:-1], cuts[1:])
+  ]
+
+# y[rows] = damping * (matrix @ x)[rows] for one block, with scipy's compiled
+# csr_matvec: a single fused pass over the block's values, run without the
+# GIL. The indptr slice is not rebased, it points into the full indices and
+# data arrays. Each row is summed entirely inside one block, so the result
+# does not depend on how the rows are split between threads.
+def _block_matvec(matrix, block, x, y, damping):
+  row_lo, row_hi, indptr = block
+  y_block = y[row_lo:row_hi]
+  y_block.fill(0.0)
+  csr_matvec(row_hi - row_lo, x.shape[0], indptr, matrix.indices,
+             matrix.data, x, y_block)
+  y_block *= damping
+
+# Build the transition matrix of the graph in CSR format.
+# Row v stores the incoming edges of v and each stored value is already
+# divided by the out-degree (or out-strength) of the source, so one iteration
+# is just P @ ranks.
+# With symmetric=True the edge list is undirected (i < j, as emitted by
+# build_book_cooccurrence_edges) and the matrix gets both directions.
+# With dtype=np.float32 the values are stored in float32 and int32 node
+# indices are kept as they are, so no float64 / int64 copy is built.
+def build_transition_matrix(
+  num_nodes,
+  src_nodes,
+  dst_nodes,
+  weights=None,
+  symmetric=False,
+  dtype=float,
+):
+  src_nodes = np.asarray(src_nodes)
+  dst_nodes = np.asarray(dst_nodes)
+  if src_nodes.dtype != np.int32 or dst_nodes.dtype != np.int32:
+    src_nodes = np.asarray(src_nodes, dtype=int)
+    dst_nodes = np.asarray(dst_nodes, dtype=int)
+  if weights is not None:
+    weights = _as_edge_weights(weights, src_nodes.shape[0], dtype)
+
+  # Out-degree of each node, dangling nodes have out_degree == 0
+  out_degree = compute_out_strength(
+    num_nodes, src_nodes, weights, dst_nodes if symmetric else None)
+  dangling_mask = (out_degree == 0)
+
+  if symmetric:
+    # A = L + L^T from the one-way edges, then divide every column u by the
+    # strength of u. Dangling columns are empty, so the 0 scale is harmless.
+    values = np.ones(src_nodes.shape[0], dtype=dtype) if weights is None else weights
+    one_way = sp.coo_matrix(
+      (values, (dst_nodes, src_nodes)),
+      shape=(num_nodes, num_nodes),
+    ).tocsr()
+    inv_strength = np.divide(
+      1.0,
+      out_degree,
+      out=np.zeros(num_nodes),
+      where=~dangling_mask,
+    ).astype(dtype, copy=False)
+    transition = (one_way + one_way.T).tocsr() @ sp.diags(inv_strength)
+    return transition.tocsr(), dangling_mask
+
+  if weights is None:
+    # Every source of an edge has out_degree >= 1, so the division is safe
+    values = 1.0 / out_degree[src_nodes]
+  else:
+    # A node whose edges all have weight 0 is dangling, its edges carry nothing
+    src_strength = out_degree[src_nodes]
+    values = np.divide(
+      weights,
+      src_strength,
+      out=np.zeros_like(weights),
+      where=src_strength > 0,
+    )
+  # Duplicate edges are summed by the COO -> CSR conversion
+  transition = sp.coo_matrix(
+    (values.astype(dtype, copy=False), (dst_nodes, src_nodes)),
+    shape=(num_nodes, num_nodes),
+  ).tocsr()
+
+  return transition, dangling_mask
+
+# Indices of the k largest scores, best first (ties broken by index).
+# argpartition finds the k-th largest score in O(n). It picks arbitrarily
+# among the scores tied with it, so every node scoring at least that much is
+# kept, and only those candidates are sorted by (-score, index).
+def top_k_nodes(scores, k):
+  scores = np.asarray(scores)
+  if k is None or k >= scores.size:
+    candidates = np.arange(scores.size)
+  else:
+    if k <= 0:
+      raise ValueError("k must be positive.")
+    kth = np.argpartition(-scores, k - 1)[k - 1]
+    candidates = np.flatnonzero(scores >= scores[kth])
+  order = np.lexsort((candidates, -scores[candidates]))
+  return candidates[order[:k]]
+
+# Top-k books by PageRank with their book mapping columns.
+# Only the k winners are looked up in book_mapping (by position, as built by
+# build_id_mappings with book_idx = row number), the full table is not
+# sorted or merged.
+def top_k_books(ranks, book_mapping, k=20, score_name="pagerank"):
+  winners = top_k_nodes(ranks, k)
+  top_books = book_mapping.iloc[winners].copy()
+  if not np.array_equal(top_books["book_idx"].to_numpy(), winners):
+    raise ValueError("book_mapping must have book_idx equal to its row number.")
+  top_books[score_name] = np.asarray(ranks)[winners]
+  return top_books
 
 # Compute PageRank scores using the power iteration method
 def pagerank_power_iteration(
@@ -9,92 +287,606 @@ def pagerank_power_iteration(
     tol=1e-6,
     max_iter=100,
     verbose=False,
+    engine="edges",
+    weights=None,
+    symmetric=False,
+    block_size=1_000_000,
+    n_threads=None,
+    solver="power",
+    extrapolate_every=10,
+    init_ranks=None,
+    return_info=False,
+    top_k_stop=None,
+    top_k_patience=3,
+    compact=False,
+    transition=None,
 ):
-  # Convert src_nodes and dst_nodes to numpy arrays of type int
-  src_nodes = np.asarray(src_nodes, dtype=int)
-  dst_nodes = np.asarray(dst_nodes, dtype=int)
+  if engine not in PAGERANK_ENGINES:
+    raise ValueError(f"engine must be one of {PAGERANK_ENGINES}, got {engine!r}.")
+  if solver not in PAGERANK_SOLVERS:
+    raise ValueError(f"solver must be one of {PAGERANK_SOLVERS}, got {solver!r}.")
+  if solver != "power" and engine == "stream":
+    raise ValueError("Accelerated solvers need the in-memory transition matrix.")
+  if top_k_stop is not None and solver != "power":
+    raise ValueError("top_k_stop is only available with solver='power'.")
+  if compact and (solver != "power" or engine == "stream"):
+    raise ValueError("compact is only available with solver='power' and the "
+                     "edges, csr or threads engines.")
+
+  # Compact mode: int32 node indices and float32 vectors in the loop.
+  # Sums over the whole vector (normalisation, dangling mass, L1 diff) are
+  # accumulated in float64 instead of using compensated (Kahan) float32 sums:
+  # NumPy's pairwise summation in float64 keeps the error far below tol for
+  # any realistic num_nodes, so tol down to ~1e-7 remains meaningful.
+  index_dtype = np.int32 if compact and num_nodes < 2**31 else int
+  rank_dtype = np.float32 if compact else float
+
+  # Keep the arrays as they are until the node range has been checked:
+  # narrowing first could wrap an out-of-range index into a valid one
+  src_nodes = np.asarray(src_nodes)
+  dst_nodes = np.asarray(dst_nodes)
+
+  # Convergence diagnostics, returned when return_info=True
+  # For the power solver the residual is the L1 diff between iterations
+  info = {
+    "engine": engine,
+    "solver": solver,
+    "iterations": 0,
+    "converged": False,
+    "diff_history": [],
+  }
+  info["residual_history"] = info["diff_history"]
+  if top_k_stop is not None:
+    info["top_k_stable"] = False
 
   # Basic checks on the inputs
   if src_nodes.shape[0] != dst_nodes.shape[0]:
     raise ValueError("src_nodes and dst_nodes must have the same length.")
-  
+
   if src_nodes.size == 0:
       # Edge case: no edges at all, return uniform distribution
       if verbose:
         print("[pagerank] No edges found. Returning uniform ranks.")
-      return np.ones(num_nodes, dtype=float) / num_nodes
+      ranks = np.ones(num_nodes, dtype=float) / num_nodes
+      info["converged"] = True
+      return (ranks, info) if return_info else ranks
 
   if src_nodes.max() >= num_nodes or dst_nodes.max() >= num_nodes:
       raise ValueError("Node indices in src_nodes/dst_nodes must be < num_nodes.")
 
-  # Compute out-degree for each node (number of outgoing edges)
-  out_degree = np.bincount(src_nodes, minlength=num_nodes).astype(float)
-  # Identify dangling nodes (nodes with no outgoing edges)
-  dangling_mask = (out_degree == 0)
-  # Initialize PageRank vector with uniform distribution
-  ranks = np.ones(num_nodes, dtype=float) / num_nodes
+  if engine != "stream":
+    # Convert src_nodes and dst_nodes to numpy arrays of type int. The stream
+    # engine keeps them as they are (no int64 copy of a memory-mapped file),
+    # blocks are converted one at a time inside the loop.
+    src_nodes = src_nodes.astype(index_dtype, copy=False)
+    dst_nodes = dst_nodes.astype(index_dtype, copy=False)
+
+  # Weighted mode: each node splits its rank proportionally to edge weights
+  if weights is not None and engine != "stream":
+    weights = _as_edge_weights(weights, src_nodes.shape[0], rank_dtype)
+  elif weights is not None and len(weights) != src_nodes.shape[0]:
+    raise ValueError("weights must have the same length as src_nodes/dst_nodes.")
+
+  # Warm start: begin from a given rank vector instead of the uniform one
+  if init_ranks is not None:
+    init_ranks = _as_init_ranks(init_ranks, num_nodes)
+
+  if transition is not None:
+    # Prebuilt transition matrix (e.g. from the artifact cache), it must come
+    # from build_transition_matrix on the same edges. Dangling nodes are its
+    # empty (or all-zero) columns.
+    if transition.shape != (num_nodes, num_nodes):
+      raise ValueError("transition must be a (num_nodes x num_nodes) matrix.")
+    if solver == "power" and engine not in ("csr", "threads"):
+      raise ValueError("transition is only used by the csr/threads engines "
+                       "and the accelerated solvers.")
+    transition = transition.tocsr().astype(rank_dtype, copy=False)
+    transition_mask = np.asarray(transition.sum(axis=0)).ravel() == 0
+
+  if solver != "power":
+    # Accelerated solvers work on the csr transition matrix, whatever the engine
+    if transition is None:
+      transition, dangling_mask = build_transition_matrix(
+        num_nodes, src_nodes, dst_nodes, weights=weights, symmetric=symmetric)
+    else:
+      dangling_mask = transition_mask
+    ranks, info = solve_pagerank(
+      transition,
+      dangling_mask,
+      damping=damping,
+      tol=tol,
+      max_iter=max_iter,
+      solver=solver,
+      extrapolate_every=extrapolate_every,
+      init_ranks=init_ranks,
+      info=info,
+      verbose=verbose,
+    )
+    return (ranks, info) if return_info else ranks
+
+  if engine in ("csr", "threads"):
+    # Build the normalised transition matrix once, the edge arrays are not
+    # touched again inside the loop
+    if transition is None:
+      transition, dangling_mask = build_transition_matrix(
+        num_nodes, src_nodes, dst_nodes, weights=weights, symmetric=symmetric,
+        dtype=rank_dtype)
+    else:
+      dangling_mask = transition_mask
+    if engine == "threads":
+      # Row blocks and thread pool are set up once for the whole run
+      n_threads = n_threads or os.cpu_count() or 1
+      row_blocks = _plan_row_blocks(transition, n_threads)
+      pool = ThreadPoolExecutor(max_workers=n_threads)
+  elif engine == "stream":
+    # One pass over the blocks for the out-degree / out-strength
+    out_degree = _stream_out_strength(
+      num_nodes, src_nodes, dst_nodes, weights, symmetric, block_size)
+    dangling_mask = (out_degree == 0)
+    rank_share = np.zeros(num_nodes, dtype=float)
+  else:
+    # Compute out-degree for each node (number of outgoing edges),
+    # or out-strength in weighted mode
+    out_degree = compute_out_strength(
+      num_nodes, src_nodes, weights, dst_nodes if symmetric else None)
+    out_degree = out_degree.astype(rank_dtype, copy=False)
+    # Identify dangling nodes (nodes with no outgoing edges)
+    dangling_mask = (out_degree == 0)
+    if symmetric:
+      # Rank of each node divided by its degree, refreshed every iteration
+      rank_share = np.zeros(num_nodes, dtype=rank_dtype)
+    elif weights is not None:
+      # Share of the source rank carried by each edge, computed once
+      src_strength = out_degree[src_nodes]
+      edge_share = np.divide(
+        weights,
+        src_strength,
+        out=np.zeros_like(weights),
+        where=src_strength > 0,
+      )
+
+  # Initialize PageRank vector with uniform distribution (or the warm start)
+  if init_ranks is not None:
+    ranks = init_ranks.astype(rank_dtype, copy=False)
+  else:
+    ranks = np.full(num_nodes, 1.0 / num_nodes, dtype=rank_dtype)
 
   # Precompute teleportation term (uniform teleport)
   teleport = (1.0 - damping) / num_nodes
 
   if verbose:
       print("[pagerank] Starting power iteration...")
+      print(f"[pagerank] engine    = {engine}")
+      print(f"[pagerank] weighted  = {weights is not None}")
+      print(f"[pagerank] symmetric = {symmetric}")
+      print(f"[pagerank] warm start = {init_ranks is not None}")
       print(f"[pagerank] num_nodes = {num_nodes}")
       print(f"[pagerank] damping   = {damping}")
       print(f"[pagerank] tol       = {tol}")
       print(f"[pagerank] max_iter  = {max_iter}")
+      print(f"[pagerank] top_k_stop = {top_k_stop}")
+      print(f"[pagerank] compact   = {compact}")
       print(f"[pagerank] teleport term = {teleport}")
 
-  # Power iteration loop
-  for it in range(1, max_iter + 1):
-      # Keep a copy of the current ranks
-      ranks_old = ranks
-
-      # Contribution from dangling nodes: their rank is redistributed uniformly
-      dangling_rank = ranks_old[dangling_mask].sum()
-      dangling_contrib = damping * dangling_rank / num_nodes
-      # Contribution passed along the edges
-      # Each outgoing edge from node u carries ranks_old[u] / out_degree[u]
-      valid_src_mask = (out_degree[src_nodes] > 0)
-      contrib_weights = np.zeros_like(src_nodes, dtype=float)
-      contrib_weights[valid_src_mask] = (
-          ranks_old[src_nodes[valid_src_mask]] /
-          out_degree[src_nodes[valid_src_mask]]
-      )
+  # Preallocated buffers for the csr engine: the new ranks are written into
+  # the vector of two iterations ago instead of allocating a fresh one
+  if engine in ("csr", "threads"):
+    ranks_next = np.empty(num_nodes, dtype=rank_dtype)
+    diff_buffer = np.empty(num_nodes, dtype=rank_dtype)
 
-      # Sum contributions for each destination node
-      link_contrib = np.bincount(
-          dst_nodes,
-          weights=contrib_weights,
-          minlength=num_nodes,
-      )
+  # Top-k stopping: number of consecutive iterations with the same top-k list
+  top_k_prev = None
+  top_k_streak = 0
 
-      # Apply damping factor to the contribution coming from links
-      link_contrib *= damping
-      # Combine teleportation, dangling contribution and link contribution
-      ranks = teleport + dangling_contrib + link_contrib
-      # Normalize to ensure the ranks sum to 1 (numerical stability)
-      ranks_sum = ranks.sum()
-      if ranks_sum > 0:
-          ranks /= ranks_sum
+  # The thread pool is shut down even if an iteration raises
+  try:
+    # Power iteration loop
+    for it in range(1, max_iter + 1):
+        # Keep a copy of the current ranks
+        ranks_old = ranks
 
-      # Compute L1 difference between consecutive iterations
-      diff = np.abs(ranks - ranks_old).sum()
+        # Contribution from dangling nodes: their rank is redistributed uniformly
+        dangling_rank = ranks_old[dangling_mask].sum(dtype=np.float64)
+        dangling_contrib = damping * dangling_rank / num_nodes
 
-      if verbose:
-          print(f"[pagerank] Iteration {it:3d} – diff = {diff:.6e}")
+        if engine in ("csr", "threads"):
+          # Single sparse mat-vec, written straight into the spare buffer
+          ranks = ranks_next
+          if engine == "threads":
+            # Every block writes its own rows of ranks, wait for all of them
+            list(pool.map(
+              lambda block: _block_matvec(
+                transition, block, ranks_old, ranks, damping),
+              row_blocks,
+            ))
+          else:
+            # csr_matvec accumulates P @ ranks_old into ranks, no temporary
+            ranks.fill(0.0)
+            csr_matvec(num_nodes, num_nodes, transition.indptr,
+                       transition.indices, transition.data, ranks_old, ranks)
+            ranks *= damping
+          ranks += teleport + dangling_contrib
+          ranks_sum = ranks.sum(dtype=np.float64)
+          if ranks_sum > 0:
+            ranks /= ranks_sum
+          np.subtract(ranks, ranks_old, out=diff_buffer)
+          np.abs(diff_buffer, out=diff_buffer)
+          diff = diff_buffer.sum(dtype=np.float64)
+          # The old vector becomes the buffer for the next iteration
+          ranks_next = ranks_old
+        else:
+          # Contribution passed along the edges
+          if engine == "stream":
+            # Node-level share of the rank, then one pass over the edge blocks
+            np.divide(ranks_old, out_degree, out=rank_share, where=~dangling_mask)
+            link_contrib = _stream_link_contrib(
+              num_nodes, src_nodes, dst_nodes, weights, symmetric, block_size,
+              rank_share)
+          elif symmetric:
+            # Undirected edges: node u sends ranks_old[u] / out_degree[u]
+            # (times the weight) along each incident edge, in both directions
+            np.divide(ranks_old, out_degree, out=rank_share, where=~dangling_mask)
+            # Direction src -> dst
+            contrib_weights = rank_share[src_nodes]
+            if weights is not None:
+              contrib_weights *= weights
+            link_contrib = np.bincount(
+                dst_nodes,
+                weights=contrib_weights,
+                minlength=num_nodes,
+            )
+            # Direction dst -> src, reusing the same arrays
+            contrib_weights = rank_share[dst_nodes]
+            if weights is not None:
+              contrib_weights *= weights
+            link_contrib += np.bincount(
+                src_nodes,
+                weights=contrib_weights,
+                minlength=num_nodes,
+            )
+          elif weights is not None:
+            # Each edge u -> v carries ranks_old[u] * w(u, v) / strength[u]
+            contrib_weights = ranks_old[src_nodes] * edge_share
+          else:
+            # Each outgoing edge from node u carries ranks_old[u] / out_degree[u]
+            valid_src_mask = (out_degree[src_nodes] > 0)
+            contrib_weights = np.zeros_like(src_nodes, dtype=rank_dtype)
+            contrib_weights[valid_src_mask] = (
+                ranks_old[src_nodes[valid_src_mask]] /
+                out_degree[src_nodes[valid_src_mask]]
+            )
+
+          if engine == "edges" and not symmetric:
+            # Sum contributions for each destination node
+            link_contrib = np.bincount(
+                dst_nodes,
+                weights=contrib_weights,
+                minlength=num_nodes,
+            )
+
+          # Apply damping factor to the contribution coming from links
+          link_contrib *= damping
+          # Combine teleportation, dangling contribution and link contribution
+          # (bincount accumulates in float64, the result is stored as rank_dtype)
+          ranks = (teleport + dangling_contrib + link_contrib).astype(
+            rank_dtype, copy=False)
+          # Normalize to ensure the ranks sum to 1 (numerical stability)
+          ranks_sum = ranks.sum(dtype=np.float64)
+          if ranks_sum > 0:
+              ranks /= ranks_sum
+
+          # Compute L1 difference between consecutive iterations
+          diff = np.abs(ranks - ranks_old).sum(dtype=np.float64)
+
+        info["iterations"] = it
+        info["diff_history"].append(float(diff))
 
-      # Check convergence
-      if diff < tol:
         if verbose:
-              print(f"[pagerank] Converged in {it} iterations.")
-        break
-  else:
-      # If we exit the loop without break (no convergence before max_iter)
-      if verbose:
-          print(
-              f"[pagerank] Reached max_iter = {max_iter} "
-              f"with diff = {diff:.6e}"
-          )
+            print(f"[pagerank] Iteration {it:3d} – diff = {diff:.6e}")
+
+        # Check convergence
+        if diff < tol:
+          info["converged"] = True
+          if verbose:
+                print(f"[pagerank] Converged in {it} iterations.")
+          break
+
+        # Stop early once the top-k nodes (and their order) stop changing
+        if top_k_stop is not None:
+          top_k_now = top_k_nodes(ranks, top_k_stop)
+          if top_k_prev is not None and np.array_equal(top_k_now, top_k_prev):
+            top_k_streak += 1
+          else:
+            top_k_streak = 0
+          top_k_prev = top_k_now
+          if top_k_streak >= top_k_patience:
+            info["top_k_stable"] = True
+            if verbose:
+              print(f"[pagerank] Top-{top_k_stop} stable for {top_k_patience} "
+                    f"iterations, stopping at iteration {it}.")
+            break
+    else:
+        # If we exit the loop without break (no convergence before max_iter)
+        if verbose:
+            print(
+                f"[pagerank] Reached max_iter = {max_iter} "
+                f"with diff = {diff:.6e}"
+            )
+  finally:
+    if engine == "threads":
+      pool.shutdown()
+
+  if return_info:
+    return ranks, info
+  return ranks
+
+# Out-of-core PageRank on an edge list saved with storage_format="npy"
+# (see build_book_cooccurrence_edges). The edge columns are memory-mapped and
+# streamed block_size edges at a time at every iteration, so only the
+# O(num_nodes) vectors are kept in memory.
+def pagerank_out_of_core(
+  num_nodes,
+  processed_dir,
+  edges_name,
+  weighted=False,
+  symmetric=True,
+  block_size=1_000_000,
+  **kwargs,
+):
+  columns = ["src_book_idx", "dst_book_idx"] + (["weight"] if weighted else [])
+  edges = load_edge_arrays(processed_dir, edges_name, columns=columns)
+  return pagerank_power_iteration(
+    num_nodes=num_nodes,
+    src_nodes=edges["src_book_idx"],
+    dst_nodes=edges["dst_book_idx"],
+    weights=edges["weight"] if weighted else None,
+    symmetric=symmetric,
+    engine="stream",
+    block_size=block_size,
+    **kwargs,
+  )
+
+# Build a (num_nodes x k) teleport matrix for personalized PageRank.
+# seed_sets[c] lists the nodes column c teleports to (uniformly), None means
+# uniform teleport over all nodes (plain PageRank).
+def teleport_matrix(num_nodes, seed_sets):
+  teleports = np.zeros((num_nodes, len(seed_sets)), dtype=float)
+  for column, seeds in enumerate(seed_sets):
+    if seeds is None:
+      teleports[:, column] = 1.0 / num_nodes
+    else:
+      seeds = np.unique(np.asarray(seeds, dtype=int))
+      if seeds.size == 0 or seeds.min() < 0 or seeds.max() >= num_nodes:
+        raise ValueError(f"Seed set {column} must contain node indices < num_nodes.")
+      teleports[seeds, column] = 1.0 / seeds.size
+  return teleports
+
+# Solve k PageRank problems on the same graph at once.
+# The rank matrix (num_nodes x k) is multiplied by the transition matrix with
+# one sparse mat-mat product per iteration instead of k mat-vecs, and the
+# transition matrix / degrees are computed only once.
+# Column c uses dampings[c] and teleports[:, c] (see teleport_matrix), and
+# dangling mass is sent back along the teleport vector, so a uniform column
+# gives the same ranks as pagerank_power_iteration. A column stops being
+# updated as soon as its L1 diff is below tol.
+def pagerank_batched(
+  num_nodes,
+  src_nodes,
+  dst_nodes,
+  dampings=(0.85,),
+  teleports=None,
+  weights=None,
+  symmetric=False,
+  tol=1e-6,
+  max_iter=100,
+  verbose=False,
+  return_info=False,
+):
+  dampings = np.atleast_1d(np.asarray(dampings, dtype=float))
+  if teleports is None:
+    teleports = teleport_matrix(num_nodes, [None] * dampings.size)
+  teleports = np.asarray(teleports, dtype=float)
+  if teleports.ndim != 2 or teleports.shape[0] != num_nodes:
+    raise ValueError("teleports must be a (num_nodes x k) matrix.")
+  num_columns = teleports.shape[1]
+  if dampings.size == 1:
+    dampings = np.full(num_columns, dampings[0])
+  if dampings.size != num_columns:
+    raise ValueError("dampings must have one value per teleport column.")
+  teleports = teleports / teleports.sum(axis=0)
+
+  transition, dangling_mask = build_transition_matrix(
+    num_nodes, src_nodes, dst_nodes, weights=weights, symmetric=symmetric)
+
+  ranks = teleports.copy()
+  active = np.ones(num_columns, dtype=bool)
+  iterations = np.zeros(num_columns, dtype=int)
+  diff_history = []
+
+  if verbose:
+    print(f"[pagerank_batched] num_nodes = {num_nodes}, columns = {num_columns}")
+
+  for it in range(1, max_iter + 1):
+    cols = np.flatnonzero(active)
+    ranks_old = ranks[:, cols]
+    damping = dampings[cols]
+
+    # Dangling and teleport mass of each column go back along its teleport vector
+    dangling_rank = ranks_old[dangling_mask].sum(axis=0)
+    restart = damping * dangling_rank + (1.0 - damping)
+    ranks_new = (transition @ ranks_old) * damping + teleports[:, cols] * restart
+    ranks_new /= ranks_new.sum(axis=0)
 
-  return ranks
\ No newline at end of file
+    diff = np.abs(ranks_new - ranks_old).sum(axis=0)
+    ranks[:, cols] = ranks_new
+    iterations[cols] = it
+    diff_history.append(dict(zip(cols.tolist(), diff.tolist())))
+
+    # Converged columns are frozen
+    active[cols[diff < tol]] = False
+    if verbose:
+      print(f"[pagerank_batched] Iteration {it:3d} – max diff = {diff.max():.6e}, "
+            f"active columns = {active.sum()}")
+    if not active.any():
+      break
+
+  if verbose:
+    print(f"[pagerank_batched] Converged columns: {num_columns - active.sum()} "
+          f"of {num_columns}")
+
+  if return_info:
+    info = {
+      "iterations": iterations,
+      "converged": ~active,
+      "diff_history": diff_history,
+    }
+    return ranks, info
+  return ranks
+
+# Row-oriented adjacency for forward push: row u holds the out-neighbours of u
+# and the transition probabilities P[v, u] (the transpose of the transition
+# matrix). Stored as the three CSR arrays so it can also be memory-mapped.
+def build_push_adjacency(num_nodes, src_nodes, dst_nodes, weights=None, symmetric=False):
+  transition, _ = build_transition_matrix(
+    num_nodes, src_nodes, dst_nodes, weights=weights, symmetric=symmetric)
+  rows = transition.T.tocsr()
+  rows.sort_indices()
+  return {
+    "indptr": rows.indptr.astype(np.int64),
+    "indices": rows.indices.astype(np.int32),
+    "probs": rows.data.astype(float),
+  }
+
+# Save a push adjacency as an npy table (one .npy per array)
+def save_push_adjacency(adjacency, processed_dir, name="push_adjacency"):
+  path = table_path(processed_dir, name, "npy")
+  os.makedirs(path, exist_ok=True)
+  with open(os.path.join(path, "columns.txt"), "w") as f:
+    f.write("\n".join(adjacency))
+  for key, values in adjacency.items():
+    np.save(os.path.join(path, f"{key}.npy"), values)
+  return path
+
+# Load a push adjacency saved by save_push_adjacency, memory-mapped by default:
+# a query only reads the rows of the nodes it pushes from.
+def load_push_adjacency(processed_dir, name="push_adjacency", mmap_mode="r"):
+  path = table_path(processed_dir, name, "npy")
+  return load_npy_columns(path, ["indptr", "indices", "probs"], mmap_mode=mmap_mode)
+
+# Forward push from one seed set, with dense scratch arrays shared between
+# queries: ppr, residual and seen are reset on the touched nodes only, so a query
+# costs O(pushed edges) and not O(num_nodes).
+# A node u is pushed while residual[u] >= epsilon * max(out_degree(u), 1):
+# it keeps (1 - damping) of its residual as score and spreads the rest to its
+# out-neighbours. Dangling nodes send the rest back to the seeds, as the
+# teleport-dangling convention of pagerank_batched.
+def _forward_push(adjacency, seeds, damping, epsilon, ppr, residual, queued, seen):
+  indptr = adjacency["indptr"]
+  indices = adjacency["indices"]
+  probs = adjacency["probs"]
+  teleport = 1.0 - damping
+
+  touched = [seeds]
+  seen[seeds] = True
+  residual[seeds] = 1.0 / seeds.size
+  queue = deque(seeds.tolist())
+  queued[seeds] = True
+  pushes = 0
+
+  while queue:
+    u = queue.popleft()
+    queued[u] = False
+    start, stop = int(indptr[u]), int(indptr[u + 1])
+    mass = residual[u]
+    if mass < epsilon * max(stop - start, 1):
+      continue
+    residual[u] = 0.0
+    ppr[u] += teleport * mass
+    pushes += 1
+
+    if stop == start:
+      neighbours = seeds
+      shares = damping * mass / seeds.size
+    else:
+      neighbours = np.asarray(indices[start:stop])
+      shares = damping * mass * np.asarray(probs[start:stop])
+    residual[neighbours] += shares
+    new = neighbours[~seen[neighbours]]
+    seen[new] = True
+    touched.append(new)
+
+    # Enqueue the neighbours that went above their threshold
+    degree = np.maximum(
+      np.asarray(indptr[neighbours + 1]) - np.asarray(indptr[neighbours]), 1)
+    ready = neighbours[(residual[neighbours] >= epsilon * degree) & ~queued[neighbours]]
+    queued[ready] = True
+    queue.extend(ready.tolist())
+
+  touched = np.concatenate(touched).astype(np.int64)
+  return touched, pushes
+
+# Indices and scores of the k largest entries of scores[nodes], best first
+def _top_k_of(nodes, scores, k):
+  nodes = nodes[top_k_nodes(scores[nodes], k)]
+  return nodes, scores[nodes]
+
+# Approximate personalized PageRank of many seed sets with forward push
+# (Andersen-Chung-Lang). adjacency comes from build_push_adjacency or
+# load_push_adjacency (in memory or memory-mapped).
+# Every query touches only the neighbourhood reached by its pushes, and stops
+# when the residual left on every node v is below epsilon * out_degree(v):
+# a smaller epsilon gives more accurate scores and a larger neighbourhood.
+# seed_sets is a list of seeds (a node index or a list of node indices).
+# Returns one (nodes, scores) pair per seed set, the top_k nodes by score.
+def personalized_pagerank_push_batch(
+  adjacency,
+  seed_sets,
+  damping=0.85,
+  epsilon=1e-6,
+  top_k=10,
+  verbose=False,
+):
+  if not 0.0 <= damping < 1.0:
+    raise ValueError("damping must be in [0, 1).")
+  if epsilon <= 0:
+    raise ValueError("epsilon must be positive.")
+
+  num_nodes = len(adjacency["indptr"]) - 1
+  ppr = np.zeros(num_nodes)
+  residual = np.zeros(num_nodes)
+  queued = np.zeros(num_nodes, dtype=bool)
+  seen = np.zeros(num_nodes, dtype=bool)
+
+  results = []
+  for query, seeds in enumerate(seed_sets):
+    seeds = np.unique(np.atleast_1d(np.asarray(seeds, dtype=np.int64)))
+    if seeds.size == 0 or seeds.min() < 0 or seeds.max() >= num_nodes:
+      raise ValueError(f"Seed set {query} must contain node indices < num_nodes.")
+
+    touched, pushes = _forward_push(
+      adjacency, seeds, damping, epsilon, ppr, residual, queued, seen)
+    results.append(_top_k_of(touched[ppr[touched] > 0], ppr, top_k))
+    if verbose:
+      print(f"[personalized_pagerank_push] Query {query}: {pushes} pushes, "
+            f"{touched.size} touched nodes")
+
+    # Reset the scratch arrays on the touched nodes only
+    ppr[touched] = 0.0
+    residual[touched] = 0.0
+    seen[touched] = False
+
+  return results
+
+# Approximate personalized PageRank of a single seed set (see
+# personalized_pagerank_push_batch)
+def personalized_pagerank_push(
+  adjacency,
+  seeds,
+  damping=0.85,
+  epsilon=1e-6,
+  top_k=10,
+  verbose=False,
+):
+  return personalized_pagerank_push_batch(
+    adjacency, [seeds], damping=damping, epsilon=epsilon, top_k=top_k,
+    verbose=verbose)[0]
@@ -0,0 +1,240 @@
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import bicgstab, gmres
+
+# Accelerated solvers available in pagerank_power_iteration (besides "power")
+# "gauss_seidel": block Gauss-Seidel sweeps on the PageRank fixed point
+# "aitken":       power iteration with Aitken extrapolation every k iterations
+# "quadratic":    power iteration with quadratic extrapolation every k iterations
+# "gmres":        restarted GMRES on (I - d P) y = 1/n
+# "bicgstab":     BiCGSTAB on (I - d P) y = 1/n
+ACCELERATED_SOLVERS = ("gauss_seidel", "aitken", "quadratic", "gmres", "bicgstab")
+
+# All the solvers below use the same transition matrix P as the csr engine
+# (see build_transition_matrix): column u holds the edges of u divided by its
+# out-degree, dangling columns are empty.
+# With uniform teleport and dangling mass spread uniformly, the PageRank vector
+# is proportional to the solution y of the linear system (I - d P) y = 1/n,
+# so the linear solvers compute y and normalise it to sum 1.
+
+# One step of the power iteration (same update as pagerank_power_iteration)
+def _power_step(transition, dangling_mask, damping, ranks):
+  num_nodes = ranks.shape[0]
+  dangling_contrib = damping * ranks[dangling_mask].sum() / num_nodes
+  new_ranks = damping * (transition @ ranks)
+  new_ranks += (1.0 - damping) / num_nodes + dangling_contrib
+  return new_ranks / new_ranks.sum()
+
+# Aitken extrapolation from three consecutive iterates, componentwise.
+# Components where the second difference vanishes keep the last iterate.
+def _aitken_extrapolation(x0, x1, x2):
+  first_diff = x1 - x0
+  second_diff = x2 - 2.0 * x1 + x0
+  safe = np.abs(second_diff) > 1e-300
+  extrapolated = x2.copy()
+  extrapolated[safe] = x0[safe] - first_diff[safe] ** 2 / second_diff[safe]
+  return extrapolated
+
+# Quadratic extrapolation (Kamvar et al.) from four consecutive iterates
+def _quadratic_extrapolation(x0, x1, x2, x3):
+  y1 = x1 - x0
+  y2 = x2 - x0
+  y3 = x3 - x0
+  # Least squares for gamma_1, gamma_2 with gamma_3 = 1
+  gamma, *_ = np.linalg.lstsq(np.column_stack([y1, y2]), -y3, rcond=None)
+  gamma_1, gamma_2, gamma_3 = gamma[0], gamma[1], 1.0
+  beta_0 = gamma_1 + gamma_2 + gamma_3
+  beta_1 = gamma_2 + gamma_3
+  beta_2 = gamma_3
+  return beta_0 * x1 + beta_1 * x2 + beta_2 * x3
+
+# Power iteration with an extrapolation step every extrapolate_every iterations
+def _extrapolated_power(
+  transition,
+  dangling_mask,
+  damping,
+  tol,
+  max_iter,
+  ranks,
+  method,
+  extrapolate_every,
+  info,
+  verbose,
+):
+  history = [ranks]
+  needed = 3 if method == "aitken" else 4
+  for it in range(1, max_iter + 1):
+    new_ranks = _power_step(transition, dangling_mask, damping, history[-1])
+    history = (history + [new_ranks])[-needed:]
+
+    if it % extrapolate_every == 0 and len(history) == needed:
+      if method == "aitken":
+        extrapolated = _aitken_extrapolation(*history)
+      else:
+        extrapolated = _quadratic_extrapolation(*history)
+      # Extrapolation can leave tiny negative entries: clip and renormalise
+      extrapolated = np.clip(extrapolated, 0.0, None)
+      if extrapolated.sum() > 0:
+        new_ranks = extrapolated / extrapolated.sum()
+        # Restart the history from the extrapolated vector
+        history = [new_ranks]
+        if verbose:
+          print(f"[pagerank] Iteration {it:3d} – {method} extrapolation")
+
+    residual = np.abs(new_ranks - ranks).sum()
+    ranks = new_ranks
+    info["iterations"] = it
+    info["residual_history"].append(float(residual))
+    if verbose:
+      print(f"[pagerank] Iteration {it:3d} – diff = {residual:.6e}")
+    if residual < tol:
+      info["converged"] = True
+      break
+  return ranks
+
+# Block Gauss-Seidel sweeps on the PageRank fixed point
+# x = d P x + (d * dangling_mass(x) + 1 - d) / n.
+# The rows are split in n_blocks blocks and each block is updated with the
+# values of the blocks already updated in the same sweep. Within a block the
+# update is vectorised (Jacobi), so a sweep costs one sparse mat-vec like a
+# power iteration but propagates faster. x is renormalised after each sweep.
+def _block_gauss_seidel(
+  transition,
+  dangling_mask,
+  damping,
+  tol,
+  max_iter,
+  ranks,
+  n_blocks,
+  info,
+  verbose,
+):
+  num_nodes = transition.shape[0]
+  cuts = np.linspace(0, num_nodes, min(n_blocks, num_nodes) + 1).astype(int)
+  blocks = [
+    (lo, hi, transition[lo:hi]) for lo, hi in zip(cuts[:-1], cuts[1:])
+  ]
+
+  ranks = ranks.copy()
+  for it in range(1, max_iter + 1):
+    ranks_old = ranks.copy()
+    # Teleport and dangling mass, from the ranks at the start of the sweep
+    constant = ((1.0 - damping) + damping * ranks[dangling_mask].sum()) / num_nodes
+    for lo, hi, rows in blocks:
+      ranks[lo:hi] = damping * (rows @ ranks) + constant
+    ranks /= ranks.sum()
+
+    residual = np.abs(ranks - ranks_old).sum()
+    info["iterations"] = it
+    info["residual_history"].append(float(residual))
+    if verbose:
+      print(f"[pagerank] Sweep {it:3d} – diff = {residual:.6e}")
+    if residual < tol:
+      info["converged"] = True
+      break
+  return ranks
+
+# Krylov solvers on (I - d P) y = 1/n, starting from the given ranks
+def _krylov(transition, damping, tol, max_iter, ranks, method, restart, info, verbose):
+  num_nodes = transition.shape[0]
+  system = sp.identity(num_nodes, format="csr") - damping * transition
+  rhs = np.full(num_nodes, 1.0 / num_nodes)
+  # Scale the start vector to the scale of y (sum of y is 1 / (1 - d) at most)
+  x0 = ranks * (rhs.sum() / (1.0 - damping))
+  rhs_norm = np.linalg.norm(rhs)
+
+  def record(value):
+    info["iterations"] += 1
+    info["residual_history"].append(float(value))
+    if verbose:
+      print(f"[pagerank] Iteration {info['iterations']:3d} – residual = {value:.6e}")
+
+  if method == "gmres":
+    # gmres counts maxiter in restart cycles of `restart` inner iterations:
+    # cap both so that the inner iterations never exceed max_iter
+    restart = max(1, min(restart, max_iter))
+    # pr_norm: relative residual norm at every inner iteration
+    y, exit_code = gmres(
+      system, rhs, x0=x0, rtol=tol, restart=restart,
+      maxiter=max(1, max_iter // restart),
+      callback=record, callback_type="pr_norm",
+    )
+  else:
+    # bicgstab only passes the iterate to the callback. The residual costs one
+    # extra mat-vec, so it is only computed for the verbose log; otherwise
+    # NaN is recorded and the final residual is filled in after the solve.
+    def record_bicgstab(yk):
+      if verbose:
+        record(np.linalg.norm(rhs - system @ yk) / rhs_norm)
+      else:
+        record(np.nan)
+
+    y, exit_code = bicgstab(
+      system, rhs, x0=x0, rtol=tol, maxiter=max_iter, callback=record_bicgstab,
+    )
+    if info["residual_history"] and not verbose:
+      info["residual_history"][-1] = float(np.linalg.norm(rhs - system @ y) / rhs_norm)
+
+  info["converged"] = (exit_code == 0)
+  y = np.clip(y, 0.0, None)
+  return y / y.sum()
+
+# Run one of the ACCELERATED_SOLVERS on a transition matrix.
+# Returns the ranks and fills info with the iterations used (sweeps for
+# Gauss-Seidel, inner iterations for the Krylov methods) and the residual
+# history (L1 change between iterates, relative residual norm for Krylov).
+def solve_pagerank(
+  transition,
+  dangling_mask,
+  damping=0.85,
+  tol=1e-6,
+  max_iter=100,
+  solver="gauss_seidel",
+  init_ranks=None,
+  extrapolate_every=10,
+  gs_blocks=64,
+  gmres_restart=20,
+  info=None,
+  verbose=False,
+):
+  if solver not in ACCELERATED_SOLVERS:
+    raise ValueError(f"solver must be one of {ACCELERATED_SOLVERS}, got {solver!r}.")
+
+  num_nodes = transition.shape[0]
+  if info is None:
+    info = {}
+  info.update({
+    "solver": solver,
+    "iterations": 0,
+    "converged": False,
+    "residual_history": [],
+  })
+  # For the iterative solvers the residual is the L1 diff between iterates
+  if solver in ("gmres", "bicgstab"):
+    info.pop("diff_history", None)
+  else:
+    info["diff_history"] = info["residual_history"]
+  ranks = init_ranks
+  if ranks is None:
+    ranks = np.ones(num_nodes, dtype=float) / num_nodes
+
+  if verbose:
+    print(f"[pagerank] Solver: {solver}")
+
+  if solver in ("aitken", "quadratic"):
+    ranks = _extrapolated_power(
+      transition, dangling_mask, damping, tol, max_iter, ranks,
+      solver, extrapolate_every, info, verbose)
+  elif solver == "gauss_seidel":
+    ranks = _block_gauss_seidel(
+      transition, dangling_mask, damping, tol, max_iter, ranks, gs_blocks,
+      info, verbose)
+  else:
+    ranks = _krylov(
+      transition, damping, tol, max_iter, ranks, solver, gmres_restart,
+      info, verbose)
+
+  if verbose:
+    state = "Converged" if info["converged"] else "Stopped"
+    print(f"[pagerank] {state} after {info['iterations']} iterations.")
+  return ranks, info
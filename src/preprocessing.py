@@ -1,6 +1,7 @@
-import os
 import pandas as pd
 import numpy as np
+from src.utils_io import ensure_dirs
+from src.storage import save_table
 
 # df_core is the dataset I am going to use to create the graph and do PageRank
 # The graph will have way less noise, it is going to be more connected and interesting
@@ -9,6 +10,7 @@ def build_core_dataset(
   processed_dir,
   min_reviews=2,
   save_name="ratings_core_for_graph.csv",
+  storage_format="csv",
 ):
 
   # Compute the number of reviews per user and per book
@@ -36,8 +38,7 @@ def build_core_dataset(
   print(df_core.head())
 
   # Build the full path for the output file and save the core dataset
-  core_path = os.path.join(processed_dir, save_name)
-  df_core.to_csv(core_path, index=False)
+  core_path = save_table(df_core, processed_dir, save_name, storage_format)
   print(f"Core dataset saved in: {core_path}")
 
   return df_core
@@ -49,6 +50,7 @@ def build_core_subset(
   processed_dir,
   max_users=2000,
   save_name="ratings_core_small_for_graph.csv",
+  storage_format="csv",
 ):
 
   # Total counts before filtering
@@ -77,8 +79,102 @@ def build_core_subset(
   print(df_subset.head())
 
   # Build the full path for the output file and save the subset dataset
-  subset_path = os.path.join(processed_dir, save_name)
-  df_subset.to_csv(subset_path, index=False)
+  subset_path = save_table(df_subset, processed_dir, save_name, storage_format)
   print(f"Core subset dataset saved in: {subset_path}")
 
-  return df_subset
\ No newline at end of file
+  return df_subset
+
+# Keep the rows whose user and book both have at least min_reviews rows.
+# With k_core=True the filter is repeated until nothing changes, so in the
+# result every user and every book really has >= min_reviews rows (k-core).
+def _core_row_mask(user_codes, book_codes, min_reviews, k_core):
+  keep = (user_codes >= 0) & (book_codes >= 0)
+  while True:
+    user_counts = np.bincount(user_codes[keep])
+    book_counts = np.bincount(book_codes[keep])
+    new_keep = keep.copy()
+    new_keep[keep] = (
+      (user_counts[user_codes[keep]] >= min_reviews)
+      & (book_counts[book_codes[keep]] >= min_reviews)
+    )
+    changed = new_keep.sum() != keep.sum()
+    keep = new_keep
+    if not k_core or not changed:
+      return keep
+
+# Renumber the codes still present in the kept rows as 0..n-1 (order kept)
+def _compact_codes(codes, keep, uniques):
+  present = np.zeros(len(uniques), dtype=bool)
+  present[codes[keep]] = True
+  new_codes = np.cumsum(present, dtype=np.int64) - 1
+  return new_codes[codes[keep]].astype(np.int32), uniques[present]
+
+# Fused version of build_core_dataset -> build_core_subset -> build_id_mappings.
+# Ids are factorised once (sorted, so indices are the same as build_id_mappings)
+# and the min_reviews filter, the max_users selection and the final indexing are
+# done on int codes with bincount/cumsum. The ratings are copied only once, when
+# the kept rows are selected, and files are written only if save=True.
+def build_indexed_core(
+  df_ratings_clean,
+  processed_dir=None,
+  min_reviews=2,
+  max_users=None,
+  k_core=False,
+  save=False,
+  user_mapping_name="user_id_mapping_small.csv",
+  book_mapping_name="book_id_mapping_small.csv",
+  ratings_indexed_name="ratings_core_mapping_small.csv",
+  storage_format="csv",
+):
+  print("\n[build_indexed_core] Building indexed core dataset...")
+
+  # Sorted integer codes for users and books (-1 marks a missing id)
+  user_codes, unique_users = pd.factorize(df_ratings_clean["user_id"], sort=True)
+  book_codes, unique_books = pd.factorize(df_ratings_clean["book_id"], sort=True)
+
+  # Core filter (single pass as in build_core_dataset, or up to the k-core)
+  keep = _core_row_mask(user_codes, book_codes, min_reviews, k_core)
+
+  # Keep the first max_users users in sorted id order, as build_core_subset
+  if max_users is not None:
+    active_users = np.flatnonzero(np.bincount(user_codes[keep]) > 0)
+    if len(active_users) > max_users:
+      keep &= user_codes <= active_users[max_users - 1]
+    print(f"[build_indexed_core] Limiting to first "
+          f"{min(max_users, len(active_users))} users.")
+
+  # Compact indices over the kept rows only
+  user_idx, kept_users = _compact_codes(user_codes, keep, np.asarray(unique_users))
+  book_idx, kept_books = _compact_codes(book_codes, keep, np.asarray(unique_books))
+
+  user_mapping = pd.DataFrame({
+    "user_id": kept_users,
+    "user_idx": np.arange(len(kept_users), dtype=np.int32),
+  })
+  book_mapping = pd.DataFrame({
+    "book_id": kept_books,
+    "book_idx": np.arange(len(kept_books), dtype=np.int32),
+  })
+  df_indexed = df_ratings_clean[keep].reset_index(drop=True)
+  df_indexed["user_idx"] = user_idx
+  df_indexed["book_idx"] = book_idx
+
+  print(f"[build_indexed_core] Ratings: {len(df_indexed)}")
+  print(f"[build_indexed_core] Distinct users: {len(user_mapping)}")
+  print(f"[build_indexed_core] Distinct books: {len(book_mapping)}")
+
+  if save:
+    if processed_dir is None:
+      raise ValueError("processed_dir is required when save=True.")
+    ensure_dirs([processed_dir])
+    # Ratings written sorted by user_idx, as build_id_mappings does, for
+    # build_book_cooccurrence_edges_streaming
+    for df, name in [
+      (user_mapping, user_mapping_name),
+      (book_mapping, book_mapping_name),
+      (df_indexed.sort_values("user_idx", kind="stable"), ratings_indexed_name),
+    ]:
+      path = save_table(df, processed_dir, name, storage_format)
+      print(f"[build_indexed_core] Saved: {path}")
+
+  return user_mapping, book_mapping, df_indexed
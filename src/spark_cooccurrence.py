@@ -1,9 +1,19 @@
 import os
 from itertools import combinations
+import numpy as np
 import pandas as pd
-from pyspark.sql import SparkSession
+from pyspark.sql import SparkSession, Window
+from pyspark.sql import functions as F
 from pyspark.sql.functions import col
 
+from src.graph_construction import HEAVY_USER_MODES
+
+# Methods available in build_book_cooccurrence_edges_spark
+# "rdd":       groupByKey + Python flatMap with itertools.combinations
+# "dataframe": self-join on user_idx with a.book_idx < b.book_idx and
+#              groupBy().count(), DataFrame operations only (no Python workers)
+SPARK_COOCCURRENCE_METHODS = ("rdd", "dataframe")
+
 # Create and return a Spark session
 def create_spark_session(app_name="BookCooccurrenceSparkBig", master="local[*]"):
     spark = (
@@ -21,16 +31,34 @@ def build_book_cooccurrence_edges_spark(
   ratings_indexed_filename="ratings_core_big_indexed.csv",
   max_books_per_user=50,
   min_weight=1,
+  method="rdd",
+  return_spark_df=False,
+  heavy_users="drop",
+  tile_size=1024,
 ): 
+  if method not in SPARK_COOCCURRENCE_METHODS:
+    raise ValueError(
+      f"method must be one of {SPARK_COOCCURRENCE_METHODS}, got {method!r}.")
+  if heavy_users not in HEAVY_USER_MODES:
+    raise ValueError(
+      f"heavy_users must be one of {HEAVY_USER_MODES}, got {heavy_users!r}.")
+  if heavy_users != "drop" and method != "dataframe":
+    raise ValueError("Heavy users can only be kept with method='dataframe'.")
+
   path = os.path.join(processed_dir, ratings_indexed_filename)
   print("\nSpark loading indexed ratings from:", path)
 
-  df_indexed_big_spark = (
-      spark.read
-      .option("header", True)
-      .option("inferSchema", True)
-      .csv(path)
-  )
+  if path.endswith(".parquet"):
+    # Parquet carries its own schema, nothing to infer
+    df_indexed_big_spark = spark.read.parquet(path)
+  else:
+    # No inferSchema: it costs a full extra pass over the file and the
+    # indices are cast explicitly below anyway
+    df_indexed_big_spark = (
+        spark.read
+        .option("header", True)
+        .csv(path)
+    )
 
   print("\nSpark indexed ratings schema:")
   df_indexed_big_spark.printSchema()
@@ -46,6 +74,11 @@ def build_book_cooccurrence_edges_spark(
       .dropna(subset=["user_idx_int", "book_idx_int"])
   )
 
+  if method == "dataframe":
+    edges_big_spark = _cooccurrence_edges_dataframe(
+      df_pairs, max_books_per_user, heavy_users, tile_size)
+    return _finish_edges_spark(edges_big_spark, min_weight, return_spark_df)
+
   print("\nSpark example df_pairs after safe cast and dropna:")
   df_pairs.show(5)
 
@@ -103,28 +136,176 @@ def build_book_cooccurrence_edges_spark(
   edges_big_spark.show(10)
   print("\nSpark number of edges before filter:", edges_big_spark.count())
 
+  return _finish_edges_spark(edges_big_spark, min_weight, return_spark_df)
+
+# Co-occurrence edges with DataFrame operations only, so the whole job runs
+# in the JVM (Tungsten codegen) and the shuffles move (user, book) rows
+# instead of whole book lists:
+# - distinct (user, book) pairs, like the unique() of the Python version
+# - number of books per user with a window, users with fewer than 2 or more
+#   than max_books_per_user books are dropped
+# - self-join on user_idx with a.book_idx < b.book_idx, then count per pair
+# With heavy_users="tile" or "normalize" (see HEAVY_USER_MODES in
+# graph_construction) users above max_books_per_user are kept: the sorted
+# book list of each of them is cut in chunks of tile_size books and every
+# row is replicated to the tiles (chunk a, chunk b >= a) it belongs to, so
+# the join key (user, tile_a, tile_b) spreads one heavy user over many
+# tasks, each with at most tile_size^2 pairs.
+def _cooccurrence_edges_dataframe(
+  df_pairs,
+  max_books_per_user,
+  heavy_users="drop",
+  tile_size=1024,
+):
+  user_books = (
+      df_pairs
+      .select(
+          col("user_idx_int").alias("user_idx"),
+          col("book_idx_int").alias("book_idx"),
+      )
+      .distinct()
+      .withColumn(
+          "n_books",
+          F.count("*").over(Window.partitionBy("user_idx")),
+      )
+      .filter(col("n_books") >= 2)
+  )
+  keep_heavy = heavy_users != "drop" and max_books_per_user is not None
+  if max_books_per_user is not None and not keep_heavy:
+    user_books = user_books.filter(col("n_books") <= max_books_per_user)
+
+  if not keep_heavy:
+    user_books = user_books.select("user_idx", "book_idx")
+    left = user_books.alias("a")
+    right = user_books.alias("b")
+    pairs = left.join(
+        right,
+        (col("a.user_idx") == col("b.user_idx"))
+        & (col("a.book_idx") < col("b.book_idx")),
+    )
+
+    # Long columns, same dtypes as the RDD version once in pandas
+    return (
+        pairs
+        .groupBy(
+            col("a.book_idx").cast("long").alias("src_book_idx"),
+            col("b.book_idx").cast("long").alias("dst_book_idx"),
+        )
+        .count()
+        .withColumnRenamed("count", "weight")
+    )
+
+  heavy = col("n_books") > max_books_per_user
+  _print_heavy_user_metrics(user_books, heavy, heavy_users)
+
+  # Chunk of each row in its user's sorted book list (light users: one chunk)
+  position = F.row_number().over(
+      Window.partitionBy("user_idx").orderBy("book_idx")) - 1
+  user_books = (
+      user_books
+      .withColumn("chunk", F.when(heavy, F.floor(position / tile_size)).otherwise(0).cast("int"))
+      .withColumn("n_chunks", F.when(heavy, F.ceil(col("n_books") / tile_size)).otherwise(1).cast("int"))
+  )
+  if heavy_users == "normalize":
+    pair_weight = F.when(heavy, 1.0 / (col("n_books") - 1)).otherwise(1.0)
+  else:
+    pair_weight = F.lit(1)
+
+  # Left side of tile (a, b): rows of chunk a, for every b >= a.
+  # Right side of tile (a, b): rows of chunk b, for every a <= b.
+  left = user_books.select(
+      "user_idx",
+      "book_idx",
+      pair_weight.alias("pair_weight"),
+      col("chunk").alias("tile_a"),
+      F.explode(F.sequence(col("chunk"), col("n_chunks") - 1)).alias("tile_b"),
+  ).alias("a")
+  right = user_books.select(
+      "user_idx",
+      "book_idx",
+      F.explode(F.sequence(F.lit(0), col("chunk"))).alias("tile_a"),
+      col("chunk").alias("tile_b"),
+  ).alias("b")
+  pairs = left.join(
+      right,
+      (col("a.user_idx") == col("b.user_idx"))
+      & (col("a.tile_a") == col("b.tile_a"))
+      & (col("a.tile_b") == col("b.tile_b"))
+      & (col("a.book_idx") < col("b.book_idx")),
+  )
+
+  return (
+      pairs
+      .groupBy(
+          col("a.book_idx").cast("long").alias("src_book_idx"),
+          col("b.book_idx").cast("long").alias("dst_book_idx"),
+      )
+      .agg(F.sum("a.pair_weight").alias("weight"))
+  )
+
+# Print how many users are heavy and how many pairs come from them
+# (one small aggregation over the users)
+def _print_heavy_user_metrics(user_books, heavy, heavy_users):
+  user_pairs = col("n_books") * (col("n_books") - 1) / 2
+  heavy_count, heavy_pairs, light_pairs = (
+      user_books
+      .select("user_idx", "n_books")
+      .distinct()
+      .agg(
+          F.sum(heavy.cast("long")),
+          F.sum(F.when(heavy, user_pairs).otherwise(0)),
+          F.sum(F.when(~heavy, user_pairs).otherwise(0)),
+      )
+      .first()
+  )
+  print(
+      f"\nSpark heavy users kept ({heavy_users}): {heavy_count or 0} users, "
+      f"{int(heavy_pairs or 0)} of {int((heavy_pairs or 0) + (light_pairs or 0))} pairs"
+  )
+
+# Shared tail of build_book_cooccurrence_edges_spark: filter by min_weight,
+# then either keep the Spark DataFrame or convert it to pandas
+def _finish_edges_spark(edges_big_spark, min_weight, return_spark_df):
+  if min_weight is not None and min_weight > 1:
+    edges_big_spark = edges_big_spark.filter(col("weight") >= min_weight)
+
+  if return_spark_df:
+    return edges_big_spark
+
   # Convert to pandas for comparison
   edges_df_big_spark = edges_big_spark.toPandas()
   print("\nSpark edges DataFrame shape:", edges_df_big_spark.shape)
   return edges_df_big_spark
 
-# Compare Python and Spark edge lists
+# Compare Python and Spark edge lists.
+# Node indices are compared as int64 (compact edge lists use int32), integer
+# weights exactly (uint16/uint32 vs int64 is fine) and float weights (from
+# heavy_users="normalize") with np.allclose, since the sums of 1/(n-1) can
+# be accumulated in a different order.
 def compare_edges_python_spark(edges_df_python, edges_df_spark):
-  common_cols = ["src_book_idx", "dst_book_idx", "weight"]
-  edges_py_sorted = (
-      edges_df_python[common_cols]
-      .sort_values(common_cols)
-      .reset_index(drop=True)
-  )
-  edges_sp_sorted = (
-      edges_df_spark[common_cols]
-      .sort_values(common_cols)
-      .reset_index(drop=True)
-  )
+  index_cols = ["src_book_idx", "dst_book_idx"]
+
+  def sort_edges(edges_df):
+    return (
+        edges_df[index_cols + ["weight"]]
+        .astype({column: "int64" for column in index_cols})
+        .sort_values(index_cols)
+        .reset_index(drop=True)
+    )
+
+  edges_py_sorted = sort_edges(edges_df_python)
+  edges_sp_sorted = sort_edges(edges_df_spark)
 
   same_shape = edges_py_sorted.shape == edges_sp_sorted.shape
-  same_content = edges_py_sorted.equals(edges_sp_sorted)
+  same_content = False
+  if same_shape and edges_py_sorted[index_cols].equals(edges_sp_sorted[index_cols]):
+    weights_py = edges_py_sorted["weight"].to_numpy()
+    weights_sp = edges_sp_sorted["weight"].to_numpy()
+    if np.issubdtype(weights_py.dtype, np.integer) and np.issubdtype(weights_sp.dtype, np.integer):
+      same_content = np.array_equal(weights_py, weights_sp)
+    else:
+      same_content = np.allclose(weights_py, weights_sp, rtol=1e-9, atol=1e-12)
   print("\nCompare python and spark edges")
   print("same shape:", same_shape)
   print("same content:", same_content)
-  return same_shape and same_content
\ No newline at end of file
+  return same_shape and bool(same_content)
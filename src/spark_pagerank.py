@@ -0,0 +1,251 @@
+import numpy as np
+import pandas as pd
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+from src.pagerank import pagerank_power_iteration, top_k_nodes
+from src.spark_cooccurrence import create_spark_session
+
+# Link table for the Spark PageRank: one row (node, dst, prob) per directed
+# edge, prob = weight / out-strength of node, as in build_transition_matrix.
+# With symmetric=True the i < j edge list gets both directions.
+def _spark_links(edges, weighted, symmetric, num_partitions):
+  weight = col("weight").cast("double") if weighted else F.lit(1.0)
+  links = edges.select(
+      col("src_book_idx").cast("long").alias("node"),
+      col("dst_book_idx").cast("long").alias("dst"),
+      weight.alias("w"),
+  )
+  if symmetric:
+    links = links.unionByName(
+        links.select(
+            col("dst").alias("node"),
+            col("node").alias("dst"),
+            col("w"),
+        )
+    )
+
+  strength = links.groupBy("node").agg(F.sum("w").alias("strength"))
+  links = (
+      links.join(strength, "node")
+      # Nodes whose edges all have weight 0 are dangling, their edges carry nothing
+      .filter(col("strength") > 0)
+      .select("node", "dst", (col("w") / col("strength")).alias("prob"))
+  )
+  # Partitioned by node like the rank table, so the join of every iteration
+  # does not shuffle the links again
+  return links.repartition(num_partitions, "node"), strength
+
+# PageRank on a Spark edge DataFrame (src_book_idx, dst_book_idx, weight),
+# e.g. from build_book_cooccurrence_edges_spark(return_spark_df=True), without
+# collecting the edges on the driver.
+# Same update as pagerank_power_iteration: uniform teleport, dangling mass
+# spread uniformly over the num_nodes nodes, ranks normalised to sum 1 and
+# L1 diff against tol. Ranks and links are both hash-partitioned on the node
+# column, and the rank table is checkpointed every checkpoint_every
+# iterations (reliable checkpoint if checkpoint_dir is given, local
+# checkpoint otherwise) so the lineage does not grow with the iterations.
+# Returns the rank DataFrame (book_idx, pagerank), the top_k rows collected
+# as pandas, and the convergence info.
+def pagerank_spark(
+  spark,
+  edges,
+  num_nodes,
+  damping=0.85,
+  tol=1e-6,
+  max_iter=100,
+  weighted=False,
+  symmetric=True,
+  num_partitions=None,
+  checkpoint_every=5,
+  checkpoint_dir=None,
+  top_k=20,
+  verbose=False,
+):
+  num_partitions = num_partitions or int(spark.conf.get("spark.sql.shuffle.partitions"))
+  if checkpoint_dir is not None:
+    spark.sparkContext.setCheckpointDir(checkpoint_dir)
+
+  links, strength = _spark_links(edges, weighted, symmetric, num_partitions)
+  links = links.persist()
+
+  # Every node 0..num_nodes-1 gets a rank, nodes without positive out-strength
+  # (including nodes with no edges at all) are dangling
+  non_dangling = (
+      strength.filter(col("strength") > 0)
+      .select("node", F.lit(False).alias("dangling"))
+  )
+  ranks = (
+      spark.range(num_nodes).withColumnRenamed("id", "node")
+      .join(non_dangling, "node", "left")
+      .select("node", F.coalesce(col("dangling"), F.lit(True)).alias("dangling"))
+      .withColumn("rank", F.lit(1.0 / num_nodes))
+      .repartition(num_partitions, "node")
+      .localCheckpoint()
+  )
+  # Persisted rank table of the previous iteration, released once the new
+  # one has been computed
+  cached_ranks = None
+
+  teleport = (1.0 - damping) / num_nodes
+  dangling_rank = ranks.filter(col("dangling")).agg(F.sum("rank")).first()[0] or 0.0
+  info = {
+    "iterations": 0,
+    "converged": False,
+    "diff_history": [],
+  }
+
+  if verbose:
+    print(f"[pagerank_spark] num_nodes = {num_nodes}, partitions = {num_partitions}")
+
+  for it in range(1, max_iter + 1):
+    dangling_contrib = damping * dangling_rank / num_nodes
+
+    # Rank passed along the links, summed per destination node
+    link_contrib = (
+        links.join(ranks.select("node", "rank"), "node")
+        .groupBy(col("dst").alias("node"))
+        .agg(F.sum(col("prob") * col("rank")).alias("link"))
+    )
+    new_ranks = (
+        ranks.join(link_contrib, "node", "left")
+        .select(
+            "node",
+            "dangling",
+            col("rank").alias("rank_old"),
+            (
+                F.lit(teleport + dangling_contrib)
+                + F.lit(damping) * F.coalesce(col("link"), F.lit(0.0))
+            ).alias("rank"),
+        )
+    )
+    if it % checkpoint_every == 0:
+      # Cut the lineage
+      new_ranks = new_ranks.checkpoint() if checkpoint_dir else new_ranks.localCheckpoint()
+    else:
+      new_ranks = new_ranks.persist()
+
+    # Normalise, then L1 diff and the dangling mass of the next iteration in
+    # one aggregation
+    ranks_sum = new_ranks.agg(F.sum("rank")).first()[0]
+    normalised = new_ranks.withColumn("rank", col("rank") / F.lit(ranks_sum))
+    diff, dangling_rank = normalised.agg(
+        F.sum(F.abs(col("rank") - col("rank_old"))),
+        F.sum(F.when(col("dangling"), col("rank")).otherwise(0.0)),
+    ).first()
+    dangling_rank = dangling_rank or 0.0
+
+    if cached_ranks is not None:
+      cached_ranks.unpersist()
+    cached_ranks = new_ranks
+    ranks = normalised.drop("rank_old")
+
+    info["iterations"] = it
+    info["diff_history"].append(float(diff))
+    if verbose:
+      print(f"[pagerank_spark] Iteration {it:3d} – diff = {diff:.6e}")
+    if diff < tol:
+      info["converged"] = True
+      if verbose:
+        print(f"[pagerank_spark] Converged in {it} iterations.")
+      break
+
+  links.unpersist()
+
+  ranks_df = ranks.select(
+      col("node").alias("book_idx"),
+      col("rank").alias("pagerank"),
+  )
+  # Only the top_k rows reach the driver
+  top_ranks = (
+      ranks_df
+      .orderBy(F.desc("pagerank"), "book_idx")
+      .limit(top_k)
+      .toPandas()
+  )
+  return ranks_df, top_ranks, info
+
+# Compare the top-k of the Spark PageRank with the NumPy ranks of
+# pagerank_power_iteration on the same graph
+def compare_pagerank_numpy_spark(ranks_numpy, top_ranks_spark, atol=1e-6):
+  top_k = len(top_ranks_spark)
+  top_numpy = top_k_nodes(ranks_numpy, top_k)
+  top_spark = top_ranks_spark["book_idx"].to_numpy()
+
+  same_top_k = np.array_equal(np.sort(top_numpy), np.sort(top_spark))
+  max_abs_diff = float(np.max(np.abs(
+      np.asarray(ranks_numpy)[top_spark] - top_ranks_spark["pagerank"].to_numpy()
+  ))) if top_k else 0.0
+  print("\nCompare numpy and spark PageRank")
+  print(f"same top-{top_k} books:", same_top_k)
+  print("max abs diff on the top books:", max_abs_diff)
+  return same_top_k and max_abs_diff <= atol
+
+# Run pagerank_spark and the NumPy pagerank_power_iteration (csr engine) on
+# the same i < j edge list (pandas DataFrame src_book_idx, dst_book_idx,
+# weight) and compare the top_k books. A tight tol makes both stop after the
+# same number of iterations, so the ranks only differ by rounding.
+def check_pagerank_spark_local(
+  spark,
+  edges_df,
+  num_nodes,
+  damping=0.85,
+  tol=1e-10,
+  max_iter=200,
+  weighted=False,
+  top_k=20,
+  atol=1e-8,
+):
+  ranks_numpy, info_numpy = pagerank_power_iteration(
+    num_nodes=num_nodes,
+    src_nodes=edges_df["src_book_idx"].values,
+    dst_nodes=edges_df["dst_book_idx"].values,
+    damping=damping,
+    tol=tol,
+    max_iter=max_iter,
+    engine="csr",
+    weights=edges_df["weight"].values if weighted else None,
+    symmetric=True,
+    return_info=True,
+  )
+  edges = spark.createDataFrame(
+    edges_df[["src_book_idx", "dst_book_idx", "weight"]].astype("int64"))
+  _, top_ranks_spark, info_spark = pagerank_spark(
+    spark,
+    edges,
+    num_nodes,
+    damping=damping,
+    tol=tol,
+    max_iter=max_iter,
+    weighted=weighted,
+    symmetric=True,
+    top_k=top_k,
+  )
+  print(f"[check_pagerank_spark_local] iterations numpy = {info_numpy['iterations']}, "
+        f"spark = {info_spark['iterations']}")
+  return compare_pagerank_numpy_spark(ranks_numpy, top_ranks_spark, atol=atol)
+
+# Small end-to-end check on local[*]: python -m src.spark_pagerank
+# Random weighted graph with a few isolated (dangling) nodes, unweighted and
+# weighted runs must both match the NumPy ranks.
+if __name__ == "__main__":
+  rng = np.random.default_rng(0)
+  num_nodes = 2_000
+  src = rng.integers(0, num_nodes - 10, 20_000)
+  dst = rng.integers(0, num_nodes - 10, 20_000)
+  keep = src < dst
+  edges_df = (
+    pd.DataFrame({"src_book_idx": src[keep], "dst_book_idx": dst[keep]})
+    .drop_duplicates()
+    .assign(weight=lambda df: rng.integers(1, 10, len(df)))
+  )
+
+  spark = create_spark_session(app_name="PageRankSparkCheck", master="local[*]")
+  try:
+    for weighted in (False, True):
+      if not check_pagerank_spark_local(spark, edges_df, num_nodes, weighted=weighted):
+        raise AssertionError(
+          f"Spark and NumPy PageRank differ (weighted={weighted}).")
+    print("\n[check_pagerank_spark_local] Spark PageRank matches NumPy.")
+  finally:
+    spark.stop()
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Formats available for the processed tables
+# "csv":     plain text, as in the original pipeline
+# "parquet": columnar binary with narrow dtypes (needs pyarrow)
+# "npy":     one raw .npy file per column, only for numeric tables (edge lists)
+STORAGE_FORMATS = ("csv", "parquet", "npy")
+
+_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "npy": "_npy"}
+
+# Return the path of a table in the given format.
+# The extension of name is replaced, so callers can keep passing "*.csv" names.
+def table_path(directory, name, storage_format="csv"):
+  if storage_format not in STORAGE_FORMATS:
+    raise ValueError(
+      f"storage_format must be one of {STORAGE_FORMATS}, got {storage_format!r}.")
+  stem, _ = os.path.splitext(name)
+  return os.path.join(directory, stem + _EXTENSIONS[storage_format])
+
+# Guess the format of a table from its path
+def storage_format_of(path):
+  if path.endswith(".parquet"):
+    return "parquet"
+  if path.endswith(_EXTENSIONS["npy"]) or os.path.isdir(path):
+    return "npy"
+  return "csv"
+
+# Downcast numeric columns to the smallest dtype that holds their values:
+# integer columns (indices, counts) become int8/16/32, floats become float32.
+def narrow_dtypes(df):
+  df = df.copy()
+  for column in df.columns:
+    if pd.api.types.is_integer_dtype(df[column]):
+      df[column] = pd.to_numeric(df[column], downcast="integer")
+    elif pd.api.types.is_float_dtype(df[column]):
+      df[column] = df[column].astype(np.float32)
+  return df
+
+# Compact dtypes for an edge list: int32 node indices (for fewer than 2^31
+# nodes) and uint16 / uint32 weights, so the PageRank loop reads half the bytes.
+def compact_edges(edges_df):
+  edges_df = edges_df.copy()
+  for column in ("src_book_idx", "dst_book_idx"):
+    if edges_df.empty or edges_df[column].max() < 2**31:
+      edges_df[column] = edges_df[column].astype(np.int32)
+  if "weight" in edges_df.columns and pd.api.types.is_integer_dtype(edges_df["weight"]):
+    max_weight = edges_df["weight"].max() if not edges_df.empty else 0
+    if max_weight < 2**16:
+      edges_df["weight"] = edges_df["weight"].astype(np.uint16)
+    elif max_weight < 2**32:
+      edges_df["weight"] = edges_df["weight"].astype(np.uint32)
+  return edges_df
+
+# Save a table and return its path
+def save_table(df, directory, name, storage_format="csv"):
+  path = table_path(directory, name, storage_format)
+
+  if storage_format == "csv":
+    df.to_csv(path, index=False)
+  elif storage_format == "parquet":
+    narrow_dtypes(df).to_parquet(path, index=False)
+  else:
+    # One .npy per column, written as plain contiguous arrays,
+    # plus a text file that keeps the column order
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "columns.txt"), "w") as f:
+      f.write("\n".join(df.columns))
+    for column in df.columns:
+      values = df[column].to_numpy()
+      if values.dtype == object and values.size == 0:
+        # Empty table built with pd.DataFrame(columns=...), no value to store
+        values = values.astype(np.int64)
+      elif values.dtype == object and all(isinstance(v, str) for v in values):
+        # String ids (e.g. book_id "0000000123") as a fixed-width unicode
+        # array: no pickle, and they load back as the same strings
+        values = values.astype(str)
+      if values.dtype == object:
+        raise ValueError(
+          f"[save_table] Column {column!r} is not numeric, cannot store it as npy.")
+      np.save(os.path.join(path, f"{column}.npy"), values)
+
+  return path
+
+# Load the columns of an npy table as a dict of arrays.
+# With mmap_mode="r" nothing is read until it is used (zero copies).
+def load_npy_columns(path, columns=None, mmap_mode="r"):
+  if columns is None:
+    with open(os.path.join(path, "columns.txt")) as f:
+      columns = f.read().split("\n")
+  return {
+    column: np.load(os.path.join(path, f"{column}.npy"), mmap_mode=mmap_mode)
+    for column in columns
+  }
+
+# Load a table saved by save_table, the format is taken from the path
+def load_table(path, columns=None):
+  storage_format = storage_format_of(path)
+  if storage_format == "parquet":
+    return pd.read_parquet(path, columns=columns)
+  if storage_format == "npy":
+    return pd.DataFrame(load_npy_columns(path, columns, mmap_mode=None))
+  return pd.read_csv(path, usecols=columns)
+
+# Load an edge list saved in npy format as memory-mapped arrays
+def load_edge_arrays(
+  processed_dir,
+  name,
+  columns=("src_book_idx", "dst_book_idx", "weight"),
+  mmap_mode="r",
+):
+  path = table_path(processed_dir, name, "npy")
+  return load_npy_columns(path, list(columns), mmap_mode=mmap_mode)